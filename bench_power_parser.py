@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# compare the pandas based reading of a daily power log with the vectorized parser and the binary cache
+
+import os
+import time
+import tempfile
+import argparse
+import numpy as np
+import pandas as pd
+from tabulate import tabulate
+from power_utils import read_power_day, write_power_cache, read_power_day_cached
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(description="Benchmark reading full day power logs sampled at 1 Hz")
+    parser.add_argument("-f", "--file", help="Existing power log to benchmark, a synthetic one is generated by default", required=False)
+    parser.add_argument("-n", "--repeat", help="Number of timed repetitions (default: %(default)s)", required=False, type=int, default=5)
+    parser.add_argument("--errors", help="Fraction of synthetic readings replaced by an error message (default: %(default)s)", required=False, type=float, default=0.01)
+    args = parser.parse_args()
+    return(args)
+
+
+def make_day(path, errors=0.01, seed=0):
+    # one reading per second for a whole day, with a few readings replaced by error messages
+    rng = np.random.default_rng(seed)
+    with open(path, 'w') as f:
+        for second in range(86400):
+            stamp = f'{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d}'
+            if rng.random() < errors:
+                f.write(f'{stamp},Error: Unable to establish IPMI v2 / RMCP+ session\n')
+            else:
+                f.write(f'{stamp},{rng.normal(450, 40):.1f}\n')
+
+
+def legacy_read(path):
+    # the reading done by the power scripts before the vectorized parser
+    columns = ['time', 'power']
+    df = pd.read_csv(path, sep=',', header=None, names=columns)
+    df['time'] = pd.to_datetime(df['time'], format='%H:%M:%S').dt.time
+    df['power'] = pd.to_numeric(df['power'], errors='coerce')
+    return(df)
+
+
+def best_of(function, path, repeat):
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function(path)
+        timings.append(time.perf_counter() - start)
+    return(min(timings))
+
+
+def cached_read(path, cache_dir):
+    # np.load with mmap_mode only maps the file, sum the readings so every page is actually read like the parsers do
+    seconds, power = read_power_day_cached(path, cache_dir)
+    return(np.asarray(seconds).max(), np.nansum(np.asarray(power, dtype=np.float64)))
+
+
+if __name__ == "__main__":
+    args = get_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.file
+        if path is None:
+            path = os.path.join(tmp, 'power_orginfo_10.10.9.101_20240307.csv')
+            make_day(path, errors=args.errors)
+
+        # both readers have to agree before their timings mean anything
+        legacy = legacy_read(path)
+        seconds, power = read_power_day(path)
+        assert len(seconds) == len(legacy)
+        assert np.allclose(power, legacy['power'].to_numpy(dtype=np.float64), equal_nan=True)
+
+        cache_dir = os.path.join(tmp, 'cache')
+        write_power_cache(path, cache_dir)
+
+        results = [
+            ("pandas read_csv + to_datetime + to_numeric", best_of(legacy_read, path, args.repeat)),
+            ("vectorized byte parser", best_of(read_power_day, path, args.repeat)),
+            ("binary cache (memory mapped, summed)", best_of(lambda p: cached_read(p, cache_dir), path, args.repeat)),
+        ]
+        baseline = results[0][1]
+        table = pd.DataFrame([(name, seconds * 1000, baseline / seconds) for name, seconds in results],
+                             columns=["Reader", "Best time (ms)", "Speedup"])
+        print(f"{len(legacy)} rows, {os.path.getsize(path) / 1e6:.1f} MB, best of {args.repeat}")
+        print(tabulate(table, headers="keys", tablefmt="psql", showindex=False, floatfmt=".2f"))
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# run a node-local probe on many nodes at once and collect what each one prints
+
+import os
+import time
+import signal
+import argparse
+import threading
+import subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+import pandas as pd
+from tabulate import tabulate
+from slurm_utils import expand_nodelist
+
+DEFAULT_WORKERS = 256
+DEFAULT_TIMEOUT = 10.0
+
+# status is one of "ok", "error" (non zero exit or the probe could not be started),
+# "timeout" (the node took longer than the per node timeout) or "straggler" (the overall deadline passed first)
+ProbeResult = namedtuple('ProbeResult', ['node', 'status', 'returncode', 'output', 'elapsed'])
+
+
+class SSHTransport:
+    """
+    Run the probe on each node over ssh without ever prompting: no passwords, and the host keys of
+    nodes not seen before are added to known_hosts while a changed key still fails the node.
+    """
+
+    def __init__(self, ssh='ssh', connect_timeout=5):
+        self.ssh = ssh
+        self.options = ['-o', 'BatchMode=yes', '-o', f'ConnectTimeout={connect_timeout}', '-o', 'StrictHostKeyChecking=accept-new']
+
+    def command(self, node, probe):
+        return([self.ssh, *self.options, node, probe])
+
+    def env(self, node):
+        return(None)
+
+
+class LocalTransport:
+    """
+    Stand-in for ssh that runs the probe locally with $FANOUT_HOST set to the node name,
+    to try out probes and the fan-out itself without logging into any node.
+    """
+
+    def command(self, node, probe):
+        return(['/bin/sh', '-c', probe])
+
+    def env(self, node):
+        return({**os.environ, 'FANOUT_HOST': node})
+
+
+TRANSPORTS = {'ssh': SSHTransport, 'local': LocalTransport}
+
+
+def kill(proc):
+    # the probe runs in its own session, so kill its whole process group and not only the shell or ssh
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def iter_fan_out(nodes, probe, transport=None, max_workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, deadline=None):
+    """
+    Run a probe command on every node with at most max_workers running at once and yield a
+    ProbeResult per node as soon as it finishes, so the slowest nodes never hold up the others.
+    A node is killed after timeout seconds. When deadline (seconds for the whole fan-out)
+    passes, every probe still running is killed and the remaining nodes come back as stragglers.
+    """
+    transport = transport or SSHTransport()
+    running = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def run(node):
+        start = time.monotonic()
+        # check the deadline, start the probe and register it in one go, otherwise a probe started
+        # just after the deadline passed would miss the kill and run on after the fan-out returned
+        with lock:
+            if stop.is_set():
+                return(ProbeResult(node, 'straggler', None, '', 0.0))
+            try:
+                proc = subprocess.Popen(transport.command(node, probe), stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, universal_newlines=True, env=transport.env(node),
+                                        start_new_session=True)
+            except OSError as error:
+                return(ProbeResult(node, 'error', None, str(error), time.monotonic() - start))
+            running[node] = proc
+        try:
+            out, err = proc.communicate(timeout=timeout)
+            status = 'ok' if proc.returncode == 0 else 'error'
+            output = out.strip() if status == 'ok' else (err.strip() or out.strip())
+        except subprocess.TimeoutExpired:
+            kill(proc)
+            proc.communicate()
+            status, output = 'timeout', ''
+        finally:
+            with lock:
+                running.pop(node, None)
+        if stop.is_set() and status != 'ok':
+            status = 'straggler'
+        return(ProbeResult(node, status, proc.returncode, output, time.monotonic() - start))
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {pool.submit(run, node): node for node in nodes}
+    done = set()
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            done.add(future)
+            yield(future.result())
+    except TimeoutError:
+        stop.set()
+        with lock:
+            for proc in running.values():
+                kill(proc)
+        for future, node in futures.items():
+            if future in done:
+                continue
+            if future.cancel():
+                yield(ProbeResult(node, 'straggler', None, '', float(deadline)))
+            else:
+                yield(future.result())
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def fan_out(nodes, probe, transport=None, max_workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, deadline=None):
+    # all of the results of iter_fan_out as a table, one row per node
+    results = list(iter_fan_out(nodes, probe, transport, max_workers, timeout, deadline))
+    table = pd.DataFrame(results, columns=["Node", "Status", "Return code", "Output", "Elapsed (s)"])
+    table["Return code"] = table["Return code"].astype("Int64")
+    return(table)
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(description="Run a command on every node of a hostlist at the same time and print what each node returned")
+    parser.add_argument("nodelist", help="Slurm style hostlist, e.g. dn[001-064],dg[001-008]")
+    parser.add_argument("probe", help="Command to run on every node")
+    parser.add_argument("-t", "--transport", help="How to reach the nodes (default: %(default)s)", required=False, choices=sorted(TRANSPORTS), default='ssh')
+    parser.add_argument("-w", "--workers", help="Most nodes probed at once (default: %(default)s)", required=False, type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--timeout", help="Seconds before a single node is given up on (default: %(default)s)", required=False, type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument("--deadline", help="Seconds before the whole fan-out stops and reports the remaining nodes as stragglers", required=False, type=float)
+    args = parser.parse_args()
+    return(args)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    results = fan_out(expand_nodelist(args.nodelist), args.probe, TRANSPORTS[args.transport](), args.workers, args.timeout, args.deadline)
+    print(tabulate(results, headers="keys", tablefmt="psql", showindex=False, floatfmt=".3f"))
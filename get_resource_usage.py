@@ -7,6 +7,16 @@ import getpass
 import pandas as pd
 from tabulate import tabulate
 import argparse
+import os
+import sys
+import json
+import shlex
+from datetime import date, datetime, timedelta
+from slurm_utils import expand_nodelist
+from power_utils import GPFS_POWER_ROOT, PowerIndex, node_ip, power_file, last_sample
+import hbm_usage
+from fanout import TRANSPORTS, DEFAULT_WORKERS, DEFAULT_TIMEOUT, iter_fan_out
+from profiling import stage, add_profile_args, start_profile
 
 
 
@@ -19,6 +29,16 @@ def get_args():
     parser.add_argument("-e", "--high", help="Only report nodes with %% CPU usage higher than this value", required=False)
     parser.add_argument("-n", "--node", help="Only report usage on this node", required=False)
     parser.add_argument("-j", "--job", help="Only report usage for this job ID", required=False)
+    parser.add_argument("-p", "--power", help="Add each node's latest power reading and each job's energy used so far. Shared nodes count towards every job running on them", required=False, action = 'store_true')
+    parser.add_argument("-m", "--hbm", help="Add HBM used and free next to %% Memory used, collected on every node by running hbm_usage.py there", required=False, action = 'store_true')
+    parser.add_argument("--probe", help="Run this command on every node and add its output as a Probe column", required=False)
+    parser.add_argument("--transport", help="How --hbm and --probe reach the nodes (default: %(default)s)", required=False, choices=sorted(TRANSPORTS), default='ssh')
+    parser.add_argument("--workers", help="Most nodes probed at once (default: %(default)s)", required=False, type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--timeout", help="Seconds before a node probe is given up on (default: %(default)s)", required=False, type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument("--deadline", help="Seconds before all node probes stop, leaving the remaining nodes empty", required=False, type=float)
+    parser.add_argument("--power-index", help="Directory of the per day power index used for the energy so far. Point it at the index kept up to date by power_cache.py --index, otherwise the first run reads every day of every job's nodes (default: $POWER_INDEX_DIR or ~/.cache/hpc_tools/power_index)", required=False,
+                        default=os.environ.get("POWER_INDEX_DIR", os.path.expanduser("~/.cache/hpc_tools/power_index")))
+    add_profile_args(parser)
     args = parser.parse_args()
 
     if args.user:
@@ -41,28 +61,6 @@ def node_stats():
     sinfo_stats = sinfo_stats[["Node", "CPU load", "% CPUs used", "% Memory used"]]
     return(sinfo_stats)
 
-def expand_nodelist(nodelist):
-    """
-    Expand the nodelist to handle ranges and comma-separated lists.
-    Example: "dg[035-036,042]" -> ["dg035", "dg036", "dg042"]
-    """
-    pattern = re.compile(r'(\D+)\[(.+)\]')
-    match = pattern.match(nodelist)
-
-    if not match:
-        return [nodelist]
-
-    prefix, ranges = match.groups()
-    nodes = []
-
-    for part in ranges.split(','):
-        if '-' in part:
-            start, end = part.split('-')
-            nodes.extend([f"{prefix}{str(i).zfill(len(start))}" for i in range(int(start), int(end) + 1)])
-        else:
-            nodes.append(f"{prefix}{part}")
-    return(nodes)
-
 def get_job_ids_by_node(node_info):
     # Join the list of nodes into a comma-separated string
     nodelist= ",".join([node for node in node_info["Node"]])
@@ -107,11 +105,108 @@ def slurm_jobs(sinfo_stats):
     jobs = pd.DataFrame(jobs, columns=["Job ID", "Partition", "Job Name", "User","Time", "# nodes", "Job nodelist"])
     return(jobs)
 
+def job_start_times(job_ids):
+    # start time of each running job
+    result = subprocess.run(['/cm/shared/apps/slurm/current/bin/squeue', '-h', '-j', ",".join(job_ids), '-o', '%i %S'], stdout=subprocess.PIPE)
+    starts = {}
+    for line in result.stdout.decode('utf-8').split('\n'):
+        if line:
+            job_id, start = line.split()
+            starts[job_id] = datetime.strptime(start, '%Y-%m-%dT%H:%M:%S')
+    return(starts)
+
+def power_stats(final_data, index_dir):
+    """
+    Latest power reading of every node (read by seeking to the end of today's power log) and
+    energy used so far by every job (from the incrementally updated power index).
+    """
+    today = date.today()
+    nodes = final_data["Node"].unique()
+    latest = {}
+    for node in nodes:
+        ip_addr = node_ip(node)
+        try:
+            sample = last_sample(power_file(GPFS_POWER_ROOT, ip_addr, today)) if ip_addr else None
+        except FileNotFoundError:
+            sample = None
+        latest[node] = sample[1] if sample else float('nan')
+
+    job_ids = [job_id for job_id in final_data["Job ID"].dropna().unique()]
+    starts = job_start_times(job_ids) if job_ids else {}
+    # one row per node of a job, so only expand every job's nodelist once
+    pairs = final_data[["Job ID", "Job nodelist"]].dropna().drop_duplicates()
+    job_nodes = {job_id: expand_nodelist(nodelist) for job_id, nodelist in zip(pairs["Job ID"], pairs["Job nodelist"])}
+    # index every day since each job started for the nodes of that job
+    day_ips = {}
+    for job_id, start in starts.items():
+        ips = {node_ip(node) for node in job_nodes.get(job_id, [])} - {None}
+        day = start.date()
+        while day <= today:
+            day_ips.setdefault(day, set()).update(ips)
+            day += timedelta(days=1)
+    index = PowerIndex(index_dir, GPFS_POWER_ROOT)
+    for day, ips in sorted(day_ips.items()):
+        index.update(sorted(ips), [day])
+    energy = {}
+    for job_id, nodelist in job_nodes.items():
+        if job_id not in starts:
+            continue
+        energy[job_id] = sum(index.energy_since(node_ip(node), starts[job_id]) for node in nodelist if node_ip(node))
+    final_data["Power (W)"] = final_data["Node"].map(latest)
+    final_data["Job energy (Wh)"] = final_data["Job ID"].map(energy)
+    return(final_data)
+
+def add_hbm_columns(final_data, hbm):
+    # put the HBM columns (dict of node -> hbm_usage results) right after % Memory used
+    used = {node: usage['used_mb'] / 1024 for node, usage in hbm.items() if usage['total_mb'] > 0}
+    free = {node: usage['free_mb'] / 1024 for node, usage in hbm.items() if usage['total_mb'] > 0}
+    position = final_data.columns.get_loc("% Memory used") + 1
+    final_data.insert(position, "HBM used (GB)", final_data["Node"].map(used))
+    final_data.insert(position + 1, "HBM free (GB)", final_data["Node"].map(free))
+    return(final_data)
+
+def probe_nodes(nodes, probe, args):
+    # output of a probe on every node, as the nodes answer; nodes that fail are left out
+    outputs = {}
+    failed = {}
+    for result in iter_fan_out(nodes, probe, TRANSPORTS[args.transport](), args.workers, args.timeout, args.deadline):
+        if result.status == 'ok':
+            outputs[result.node] = result.output
+        else:
+            failed.setdefault(result.status, []).append(result.node)
+    for status, failed_nodes in failed.items():
+        print(f"Warning: probe {status} on {len(failed_nodes)} node(s): {','.join(sorted(failed_nodes))}", file=sys.stderr)
+    return(outputs)
+
+def cluster_hbm_stats(final_data, args):
+    # run hbm_usage.py --json on every node in the report (the script is on the shared file system)
+    probe = f"{shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(hbm_usage.__file__))} --json"
+    outputs = probe_nodes(final_data["Node"].unique(), probe, args)
+    hbm = {}
+    for node, output in outputs.items():
+        try:
+            hbm[node] = json.loads(output)
+        except ValueError:
+            print(f"Warning: unexpected hbm_usage.py output on {node}: {output}", file=sys.stderr)
+    return(add_hbm_columns(final_data, hbm))
+
+def probe_stats(final_data, args):
+    outputs = probe_nodes(final_data["Node"].unique(), args.probe, args)
+    final_data["Probe"] = final_data["Node"].map(outputs)
+    return(final_data)
+
 if __name__ == "__main__":
     args, username = get_args()
-    node_info = node_stats()
-    node_jobid_info = get_job_ids_by_node(node_info)
-    jobs = slurm_jobs(node_info)
+    start_profile(args, "get_resource_usage")
+    with stage("node_stats") as current:
+        node_info = node_stats()
+        current.rows = len(node_info.index)
+    with stage("get_job_ids_by_node") as current:
+        node_jobid_info = get_job_ids_by_node(node_info)
+        current.rows = len(node_jobid_info.index)
+    with stage("slurm_jobs") as current:
+        jobs = slurm_jobs(node_info)
+        current.rows = len(jobs.index)
     if args.all:
         jobs = jobs
     elif args.low:
@@ -124,7 +219,23 @@ if __name__ == "__main__":
         node_jobid_info = node_jobid_info[node_jobid_info["Job ID"] == args.job]
     else:
         jobs = jobs[jobs["User"] == username]
-    final_data = pd.merge(node_jobid_info, jobs, on="Job ID")
+    with stage("merge") as current:
+        final_data = pd.merge(node_jobid_info, jobs, on="Job ID")
+        current.rows = len(final_data.index)
     #final_data = node_jobid_info.merge(jobs, on='Job ID', how='outer')
-    print(tabulate(final_data, headers="keys", tablefmt="psql", showindex=False))
-
+    if args.hbm:
+        with stage("hbm") as current:
+            final_data = cluster_hbm_stats(final_data, args)
+            current.rows = final_data["Node"].nunique()
+    if args.probe:
+        with stage("probe") as current:
+            final_data = probe_stats(final_data, args)
+            current.rows = final_data["Node"].nunique()
+    if args.power:
+        with stage("power") as current:
+            final_data = power_stats(final_data, args.power_index)
+            current.rows = final_data["Node"].nunique()
+    with stage("render") as current:
+        table = tabulate(final_data, headers="keys", tablefmt="psql", showindex=False)
+        current.rows = len(final_data.index)
+    print(table)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# report HBM and per NUMA node memory usage straight from sysfs, without running daxctl or numactl
+
+import os
+import re
+import glob
+import json
+import argparse
+from tabulate import tabulate
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(description="Report HBM usage on this node. By default prints the same totals as hbm_usage.pl.")
+    parser.add_argument("-n", "--numa", help="Report total, used and free memory for every NUMA node", required=False, action='store_true')
+    parser.add_argument("-j", "--jobs", help="Report the HBM used by every Slurm job on this node (from the job cgroups)", required=False, action='store_true')
+    parser.add_argument("--json", help="Print the results as JSON", required=False, action='store_true')
+    parser.add_argument("--root", help="Read sysfs below this directory instead of / (for testing against a fake tree)", required=False, default='/')
+    args = parser.parse_args()
+    return(args)
+
+
+def sys_path(root, *parts):
+    return(os.path.join(root, 'sys', *parts))
+
+
+def read_first(path):
+    try:
+        with open(path) as f:
+            return(f.read().strip())
+    except OSError:
+        return('')
+
+
+def numa_nodes(root='/'):
+    # ids of all NUMA nodes, sorted
+    paths = glob.glob(sys_path(root, 'devices', 'system', 'node', 'node[0-9]*'))
+    return(sorted(int(os.path.basename(path)[4:]) for path in paths))
+
+
+def hbm_nodes(root='/'):
+    """
+    NUMA nodes backed by HBM: the target nodes of the dax devices (what "daxctl list" reports),
+    or when there are none, the memory only NUMA nodes (no CPUs) of HBM flat mode.
+    """
+    targets = set()
+    for path in glob.glob(sys_path(root, 'bus', 'dax', 'devices', '*', 'target_node')):
+        target = read_first(path)
+        if target.lstrip('-').isdigit() and int(target) >= 0:
+            targets.add(int(target))
+    if targets:
+        return(sorted(targets))
+    return([node for node in numa_nodes(root) if read_first(sys_path(root, 'devices', 'system', 'node', f'node{node}', 'cpulist')) == ''])
+
+
+def node_meminfo(node, root='/'):
+    """
+    Memory counters of one NUMA node in kB.
+    Example line: "Node 2 MemTotal:       16777216 kB" -> {"MemTotal": 16777216, ...}
+    """
+    meminfo = {}
+    pattern = re.compile(r'Node \d+ (\w+):\s+(\d+)')
+    with open(sys_path(root, 'devices', 'system', 'node', f'node{node}', 'meminfo')) as f:
+        for line in f:
+            match = pattern.match(line)
+            if match:
+                meminfo[match.group(1)] = int(match.group(2))
+    return(meminfo)
+
+
+def numa_usage(root='/'):
+    # total, used and free MB of every NUMA node, flagging the HBM ones (one dict per node)
+    hbm = set(hbm_nodes(root))
+    rows = []
+    for node in numa_nodes(root):
+        meminfo = node_meminfo(node, root)
+        total_mb = meminfo.get('MemTotal', 0) / 1024
+        free_mb = meminfo.get('MemFree', 0) / 1024
+        rows.append({"NUMA node": node, "HBM": node in hbm, "Total (MB)": total_mb, "Used (MB)": total_mb - free_mb, "Free (MB)": free_mb})
+    return(rows)
+
+
+def hbm_usage(root='/'):
+    """Total, used and free HBM in MB summed over the HBM NUMA nodes."""
+    total_mb = 0.0
+    free_mb = 0.0
+    for node in hbm_nodes(root):
+        meminfo = node_meminfo(node, root)
+        total_mb += meminfo.get('MemTotal', 0) / 1024
+        free_mb += meminfo.get('MemFree', 0) / 1024
+    return({'total_mb': total_mb, 'used_mb': total_mb - free_mb, 'free_mb': free_mb})
+
+
+def parse_numa_stat(path, page_size):
+    """
+    Bytes used on every NUMA node by a cgroup, from its memory.numa_stat.
+    cgroup v2 lists bytes per counter ("anon N0=4096 N1=0"), the anon and file counters are added up.
+    cgroup v1 lists pages ("total=12 N0=10 N1=2"), the total line is used.
+    """
+    usage = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0].startswith('total='):
+                scale = page_size
+            elif fields[0] in ('anon', 'file'):
+                scale = 1
+            else:
+                continue
+            for field in fields[1:]:
+                if field.startswith('N') and '=' in field:
+                    node, value = field[1:].split('=')
+                    usage[int(node)] = usage.get(int(node), 0) + int(value) * scale
+    return(usage)
+
+
+def job_cgroups(root='/'):
+    # memory cgroup directory of every Slurm job on the node, for cgroup v2 and v1
+    paths = glob.glob(sys_path(root, 'fs', 'cgroup', 'system.slice', 'slurmstepd.scope', 'job_*'))
+    paths += glob.glob(sys_path(root, 'fs', 'cgroup', 'memory', 'slurm*', 'uid_*', 'job_*'))
+    return({os.path.basename(path)[4:]: path for path in paths})
+
+
+def job_hbm_usage(root='/'):
+    # HBM and total memory in MB used by every Slurm job on the node (one dict per job)
+    hbm = set(hbm_nodes(root))
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    rows = []
+    for job_id, path in sorted(job_cgroups(root).items()):
+        try:
+            usage = parse_numa_stat(os.path.join(path, 'memory.numa_stat'), page_size)
+        except OSError:
+            continue
+        hbm_mb = sum(value for node, value in usage.items() if node in hbm) / 1024 / 1024
+        rows.append({"Job ID": job_id, "HBM used (MB)": hbm_mb, "Memory used (MB)": sum(usage.values()) / 1024 / 1024})
+    return(rows)
+
+
+if __name__ == "__main__":
+    args = get_args()
+    usage = hbm_usage(args.root)
+    if args.json:
+        results = dict(usage)
+        if args.numa:
+            results['numa'] = numa_usage(args.root)
+        if args.jobs:
+            results['jobs'] = job_hbm_usage(args.root)
+        print(json.dumps(results))
+    else:
+        print(f"Total HBM = {usage['total_mb'] / 1024:8.2f} GB    {usage['total_mb']:8.0f} MB")
+        print(f"Used  HBM = {usage['used_mb'] / 1024:8.2f} GB    {usage['used_mb']:8.0f} MB")
+        print(f"Free  HBM = {usage['free_mb'] / 1024:8.2f} GB    {usage['free_mb']:8.0f} MB")
+        if args.numa:
+            print(tabulate(numa_usage(args.root), headers="keys", tablefmt="psql", showindex=False, floatfmt=".0f"))
+        if args.jobs:
+            print(tabulate(job_hbm_usage(args.root), headers="keys", tablefmt="psql", showindex=False, floatfmt=".0f"))
@@ -2,6 +2,7 @@
 
 # read in module use data from sys logs, calculate and return user requested information
 import argparse
+import os
 import sys
 import pandas as pd
 import datefinder
@@ -10,6 +11,8 @@ from datetime import date
 from datetime import datetime as dt
 from itertools import chain
 from tabulate import tabulate
+from slurm_utils import expand_nodelist, read_sacct_dump
+from profiling import stage, add_profile_args, start_profile
 
 parser = argparse.ArgumentParser(
     description="Generate stats regarding module use from data collected from HPC users"
@@ -86,6 +89,13 @@ parser.add_argument(
     action=argparse.BooleanOptionalAction,
     help="Get information on all modules that match the module name prefix",
 )
+parser.add_argument(
+    "--sacct",
+    required=False,
+    action="store",
+    help="Jobs saved with 'sacct -a -X -P --format=JobID,User,Start,End,NodeList,AllocCPUS' (with or without --noheader); match every module load to its job and print the --top modules by core-hours",
+)
+add_profile_args(parser)
 
 args = parser.parse_args()
 
@@ -98,6 +108,7 @@ user = args.user
 singletons = args.no_singletons
 start = args.start
 end = args.end
+sacct_file = args.sacct
 
 
 # read in the module usage log file
@@ -451,22 +462,170 @@ def bydate_and_user(df, start=start, end=end, user=user):
         print("#######################################################################")
 
 
+def job_nodes(jobs):
+    # one row per job and node, expanding every distinct nodelist only once
+    expanded = {nodelist: expand_nodelist(nodelist) for nodelist in jobs["NodeList"].unique()}
+    return jobs.assign(nodes=jobs["NodeList"].map(expanded)).explode("nodes")
+
+
+def attribute_jobs(df, jobs, now=None):
+    """
+    Match every module load to the job of the same user that was running on the node at the time.
+    Loads and per node jobs are both sorted by time and joined with merge_asof on the last job
+    started at or before the load. When that job had already ended, an earlier job of the same
+    user on the node may still have been running (overlapping jobs on a shared node): the running
+    maximum of the job ends tells whether one was, and only those loads are checked against all
+    of the user's jobs on the node. A load inside several jobs goes to the one started last.
+    Loads that do not fall inside any job (e.g. on login nodes) are dropped.
+    Jobs that were still running (no End) count up to now.
+    """
+    jobs = jobs.dropna(subset=["Start"])
+    if now is None:
+        now = pd.Timestamp.now()
+    jobs = jobs.assign(End=jobs["End"].fillna(now))
+    per_node = job_nodes(jobs)[["nodes", "User", "JobID", "Start", "End", "AllocCPUS"]]
+    per_node = per_node.rename(columns={"User": "users"}).sort_values("Start", kind="stable")
+    # merge_asof wants the same dtype for the "by" columns on both sides
+    per_node = per_node.astype({"nodes": str, "users": str})
+    # latest end of the user's jobs on the node started so far
+    per_node["open_until"] = per_node.groupby(["nodes", "users"])["End"].cummax()
+
+    # the logs may have the fully qualified host name, Slurm only the short one
+    short_names = {node: node.split(".")[0] for node in df["nodes"].unique()}
+    loads = df.assign(
+        time=pd.to_datetime(df["dates"], format="%Y-%m-%d %H:%M:%S", errors="coerce"),
+        nodes=df["nodes"].map(short_names),
+    )
+    loads = loads.dropna(subset=["time"]).sort_values("time")
+    loads = loads.astype({"nodes": str, "users": str})
+    loads["load"] = range(len(loads.index))
+
+    matched = pd.merge_asof(
+        loads,
+        per_node,
+        left_on="time",
+        right_on="Start",
+        by=["nodes", "users"],
+        direction="backward",
+    ).set_index("load")
+
+    # the last started job has ended, but an earlier one is still running
+    reopen = (matched["time"] > matched["End"]) & (matched["time"] <= matched["open_until"])
+    if reopen.any():
+        job_columns = ["JobID", "Start", "End", "AllocCPUS"]
+        candidates = (
+            matched.loc[reopen, ["nodes", "users", "time"]]
+            .reset_index()
+            .merge(per_node, on=["nodes", "users"])
+        )
+        candidates = candidates[
+            (candidates["Start"] <= candidates["time"])
+            & (candidates["time"] <= candidates["End"])
+        ]
+        candidates = candidates.sort_values(["load", "Start"], kind="stable")
+        candidates = candidates.drop_duplicates("load", keep="last").set_index("load")
+        matched.loc[candidates.index, job_columns] = candidates[job_columns]
+
+    matched = matched[matched["time"] <= matched["End"]]
+    return matched.drop(columns="open_until").reset_index(drop=True)
+
+
+def module_core_hours(attributed):
+    # core-hours and number of jobs per module version, each job counted once per module it loaded
+    attributed = attributed.astype({"modules": "category"})
+    per_job = attributed.drop_duplicates(["modules", "JobID"])
+    per_job = per_job.assign(
+        core_hours=per_job["AllocCPUS"]
+        * (per_job["End"] - per_job["Start"]).dt.total_seconds()
+        / 3600
+    )
+    usage = per_job.groupby("modules", as_index=False, observed=True).agg(
+        **{
+            "# of jobs": ("JobID", "size"),
+            "# of users": ("users", "nunique"),
+            "Core-hours": ("core_hours", "sum"),
+        }
+    )
+    usage["# of times loaded"] = usage["modules"].map(
+        attributed.groupby("modules", observed=True).size()
+    ).astype(int)
+    return usage.sort_values("Core-hours", ascending=False)
+
+
+def job_usage(df, sacct_file, top=topN):
+    with stage("read_sacct") as current:
+        try:
+            jobs = read_sacct_dump(sacct_file)
+        except ValueError as error:
+            print()
+            print(f"Could not read the sacct dump: {error}")
+            print()
+            exit(1)
+        current.rows = len(jobs.index)
+    # jobs that were running when the dump was taken count up to then
+    dumped = pd.Timestamp.fromtimestamp(os.path.getmtime(sacct_file))
+    with stage("attribute_jobs") as current:
+        attributed = attribute_jobs(df, jobs, now=dumped)
+        current.rows = len(df.index)
+    with stage("module_core_hours") as current:
+        usage = module_core_hours(attributed)
+        current.rows = len(attributed.index)
+
+    print()
+    print("##########################################################")
+    print(
+        f"Module loads matched to a Slurm job:    \n \t{len(attributed.index)} of {len(df.index)}"
+    )
+    print(f"Jobs that loaded a module:    \n \t{attributed['JobID'].nunique()}")
+    print("##########################################################")
+    print()
+    print(f"The following table shows the {top} modules that used the most core-hours:")
+    print()
+    print(
+        tabulate(
+            usage.head(top),
+            headers="keys",
+            tablefmt="psql",
+            showindex="never",
+            floatfmt=".1f",
+        )
+    )
+
+
 if __name__ == "__main__":
-    olddata, newdata = read_file(file)
-    old_data_df = reformat_data_old(olddata)
-    new_data_df = reformat_data_new(newdata)
-    data_df = combine_dfs(old_data_df, new_data_df)
+    start_profile(args, "parse_module_use")
+    with stage("read_file") as current:
+        olddata, newdata = read_file(file)
+        current.rows = len(olddata) + len(newdata)
+    with stage("reformat_data_old") as current:
+        old_data_df = reformat_data_old(olddata)
+        current.rows = len(olddata)
+    with stage("reformat_data_new") as current:
+        new_data_df = reformat_data_new(newdata)
+        current.rows = len(newdata)
+    with stage("combine_dfs") as current:
+        data_df = combine_dfs(old_data_df, new_data_df)
+        current.rows = len(data_df.index)
     if mod_name is not None:
         check_mod(mod_name)
-        count_usage(data_df, mod_name)
+        with stage("count_usage"):
+            count_usage(data_df, mod_name)
     if args.general is not None:
-        genstat(data_df, top=topN)
-        recent(data_df, recent=recentN)
+        with stage("genstat"):
+            genstat(data_df, top=topN)
+            recent(data_df, recent=recentN)
     if args.full is not None:
-        full(data_df)
+        with stage("full"):
+            full(data_df)
+    if sacct_file is not None:
+        with stage("job_usage"):
+            job_usage(data_df, sacct_file, top=topN)
     if user is not None and start is None:
-        byuser(data_df, user)
+        with stage("byuser"):
+            byuser(data_df, user)
     elif start is not None and user is None:
-        bydate(data_df, start, end)
+        with stage("bydate"):
+            bydate(data_df, start, end)
     elif start is not None and user is not None:
-        bydate_and_user(data_df, start, end, user)
+        with stage("bydate_and_user"):
+            bydate_and_user(data_df, start, end, user)
@@ -1,79 +1,145 @@
 import pandas as pd
 import sys
-import subprocess
+import argparse
+import json
+import time
+from datetime import date, datetime
+from tabulate import tabulate
+from power_utils import GPFS_POWER_ROOT, batch_energy, job_reports, job_totals, node_ip, PowerTail, add_integration_args, integration_options
+from slurm_utils import sacct_jobs, expand_nodelist
+from profiling import stage, add_profile_args, start_profile
 
-jobid = sys.argv[1]
+# seconds between the energy checkpoints kept for every node in --live mode
+LIVE_CHECKPOINT_INTERVAL = 60
 
-job = subprocess.run(['sacct', '-j', jobid,'--format=Start,End,AllocNodes,NodeList%30', '--noheader'],stdout=subprocess.PIPE, universal_newlines = True)
 
-results = job.stdout.split(' ')
+def get_args():
 
-# remove empty elements in results list
-cleaned = [i for i in results if i]
+    parser = argparse.ArgumentParser(description="Calculate the energy used by Slurm jobs from the node power logs. With a single job ID the energy is printed in Wh, with several job IDs, a job list file or a date range a per job energy table is printed. Both integrate every node's samples the same way, see the --max-gap to --ramp-policy options.")
+    parser.add_argument("jobid", help="Slurm job ID(s)", nargs='*')
+    parser.add_argument("-f", "--jobs-file", help="File with one job ID per line", required=False)
+    parser.add_argument("-s", "--start", help="Account every job that ran on or after this day (format: YYYY-MM-DD)", required=False, type=date.fromisoformat)
+    parser.add_argument("-e", "--end", help="Account every job that ran up to this day (format: YYYY-MM-DD). Default is today's date", required=False, type=date.fromisoformat)
+    parser.add_argument("-o", "--output", help="Write the per job energy table to this CSV file instead of printing it", required=False)
+    parser.add_argument("-l", "--live", help="Follow the energy used so far by running jobs, refreshing every --interval seconds", required=False, action='store_true')
+    parser.add_argument("-i", "--interval", help="Seconds between refreshes in --live mode (default: %(default)s)", required=False, type=float, default=60)
+    parser.add_argument("-c", "--count", help="Stop --live mode after this many refreshes (default: keep refreshing until interrupted)", required=False, type=int)
+    parser.add_argument("--json", help="In --live mode emit one JSON object per job and refresh instead of a table", required=False, action='store_true')
+    parser.add_argument("--nodes", help="For a single job also print the energy, coverage and confidence of every node", required=False, action='store_true')
+    add_integration_args(parser)
+    add_profile_args(parser)
+    args = parser.parse_args()
 
-time_start = cleaned[0].split('T')[1]
-time_end = cleaned[1].split('T')[1]
+    jobids = list(args.jobid)
+    if args.jobs_file:
+        with open(args.jobs_file) as f:
+            jobids.extend(line.strip() for line in f if line.strip())
+    if not jobids and args.start is None:
+        parser.error("give a job ID, a --jobs-file or a --start date")
+    if args.live and not jobids:
+        parser.error("--live needs the job IDs of running jobs")
+    return(args, jobids)
 
-number_nodes = cleaned[2]
-nodes = cleaned[3]
 
-# getting nodelist
-node_list = [0] * int(number_nodes)
-node_x = nodes[3:len(nodes)-1]
-if int(number_nodes) == 1:
-    node_list[0] = int(nodes[3:6])
-else:
-        for x in node_x.split(','):
-            if '-' in x:
-                lnum, rnum = x.split('-')
-                lnum, rnum = int(lnum), int(rnum)
-                node_list.extend(range(lnum, rnum + 1))
-            else:
-                lnum = int(x)
-                node_list.append(lnum)
-           
+def job_energy(jobid, options=None):
+    # the job's start, end and nodes from sacct, then the power of every node over its full date and time window
+    with stage('sacct'):
+        jobs = sacct_jobs(jobs=[jobid])
+    jobs = jobs[(jobs['JobID'] == str(jobid)) & jobs['Start'].notna() & jobs['End'].notna()]
+    if jobs.empty:
+        raise SystemExit(f"Job {jobid} was not found in sacct or has not finished yet")
+    # the same job_reports and job_totals as batch_energy, so a job gets the same energy on its own as in a batch
+    with stage('job_reports'):
+        reports = job_reports(jobs, GPFS_POWER_ROOT, **(options or {}))
+    totals = job_totals(reports, (options or {}).get('gap_fill', 'mean'))
+    energy = totals['Energy (Wh)'].get(str(jobid), float('nan'))
+    return(energy, reports.drop(columns='JobID'))
 
-date = cleaned[0].split('T')[0].replace('-','')
-year = date[0:4]
-month = date[4:6]
-day = date[6:8]
 
-sum = float(0)
-count = int(0)
-cpu = nodes[0:2]
-for i in range(0, len(node_list)):
-    j = int(node_list[i])
-    if j == 0:
-        continue
-    else:
-        count += 1
-        if cpu == 'xm':
-           ip_addr = f'10.10.9.{str(j)}'
+def batch(jobids, start=None, end=None, options=None):
+    # one sacct query for all of the jobs, then each node power file is read once for all of them
+    if start is not None and end is None:
+        end = date.today()
+    with stage('sacct') as current:
+        jobs = sacct_jobs(jobs=jobids, start=start, end=end)
+        current.rows = len(jobs.index)
+    with stage('batch_energy') as current:
+        table = batch_energy(jobs, GPFS_POWER_ROOT, options=options)
+        current.rows = len(table.index)
+    return(table)
+
+
+def live(jobids, interval=60, count=None, as_json=False):
+    """
+    Tail the current power file of every allocated node, only reading the samples appended since the last refresh.
+    sacct is asked once per refresh, so jobs that start later are picked up and a job that ended is
+    counted up to its End, shown one last time and then dropped.
+    """
+    tails = {}
+    refresh = 0
+    while True:
+        with stage('sacct'):
+            jobs = sacct_jobs(jobs=jobids)
+        now = datetime.now()
+        jobs = jobs[jobs['Start'].notna() & ((jobs['State'] == 'RUNNING') | jobs['JobID'].isin(tails))]
+        if jobs.empty:
+            print("None of the jobs are running", file=sys.stderr)
+            return
+        rows = []
+        for job in jobs.itertuples(index=False):
+            start = job.Start.to_pydatetime()
+            if job.JobID not in tails:
+                # the checkpoints give the energy at the job's End even when a refresh already read past it
+                tails[job.JobID] = [PowerTail(GPFS_POWER_ROOT, ip_addr, start, checkpoint_interval=LIVE_CHECKPOINT_INTERVAL)
+                                    for ip_addr in map(node_ip, expand_nodelist(job.NodeList)) if ip_addr]
+            finished = job.State != 'RUNNING'
+            end = now
+            if finished:
+                # freeze the tails at the end of the job, whatever the power logs show afterwards
+                end = job.End.to_pydatetime() if pd.notna(job.End) else now
+                for tail in tails[job.JobID]:
+                    tail.stop_at(end)
+            with stage('update'):
+                energy = sum(tail.update(now) for tail in tails[job.JobID])
+            if finished:
+                energy = sum(tail.energy_at((end - start).total_seconds()) for tail in tails[job.JobID]) / 3600.0
+            power = sum(tail.last_power for tail in tails[job.JobID] if tail.last_power is not None)
+            elapsed = (end - start).total_seconds() / 60.0 / 60.0
+            rows.append({"Job ID": job.JobID, "State": job.State, "Nodes": len(tails[job.JobID]), "Elapsed (h)": elapsed,
+                         "Power (W)": 0.0 if finished else power, "Energy (Wh)": energy})
+            if finished:
+                del tails[job.JobID]
+        if as_json:
+            for row in rows:
+                print(json.dumps({"time": now.isoformat(timespec='seconds'), **row}), flush=True)
         else:
-            if j < 10:
-               index = '0' + str(j)
-            else:
-               index =  str(j)
-        if cpu == 'dg':
-            ip_addr = f'10.10.9.2{index}'
-        elif cpu == 'dn':
-            ip_addr = f'10.10.9.1{index}'
-        if (j != 0):
-            file_to_open = f'/gpfs/power_monitoring/power/{year}/{year}{month}/{month}{day}/power_orginfo_{ip_addr}_{date}.csv'
-            columns =['time','power']
-            df=pd.read_csv(file_to_open,sep=',',header=None,names=columns)
-            times=pd.to_datetime(df['time'],format='%H:%M:%S').dt.time
-            #Replace any error messages with NaN so the averaging can work
-            df['power'] = pd.to_numeric(df['power'], errors='coerce')
-            #excluded first 2 and last data point
-            #power_sum = df.loc[(df['time'] > time_start) & (df['time'] < time_end), 'power'].mean()
-            job_df = df.loc[(df['time'] > time_start) & (df['time'] < time_end)].iloc[2:-1] 
-            power_sum = job_df['power'].mean()
-            sum += power_sum
-# job duration
-timedelta = pd.to_datetime(time_end,format='%H:%M:%S') - pd.to_datetime(time_start,format='%H:%M:%S')
-duration =  timedelta.seconds / 60.0 / 60.0
+            print(now.strftime('%Y-%m-%d %H:%M:%S'))
+            print(tabulate(pd.DataFrame(rows), headers="keys", tablefmt="psql", showindex=False, floatfmt=".3f"), flush=True)
+        refresh += 1
+        if not tails or (count is not None and refresh >= count):
+            break
+        time.sleep(interval)
 
-energy = sum * duration
-print (energy, 'Wh')
 
+if __name__ == "__main__":
+    args, jobids = get_args()
+    start_profile(args, "power-script")
+    if args.live:
+        try:
+            live(jobids, args.interval, args.count, args.json)
+        except KeyboardInterrupt:
+            # Ctrl-C is the normal way to stop following the jobs
+            print(file=sys.stderr)
+    elif len(jobids) == 1 and args.start is None and args.output is None:
+        energy, report = job_energy(jobids[0], integration_options(args))
+        if args.nodes:
+            with stage('render'):
+                print(tabulate(report, headers="keys", tablefmt="psql", showindex=False, floatfmt=".3f"))
+        print (energy, 'Wh')
+    else:
+        table = batch(jobids, args.start, args.end, integration_options(args))
+        with stage('render'):
+            if args.output:
+                table.to_csv(args.output, index=False)
+            else:
+                print(tabulate(table, headers="keys", tablefmt="psql", showindex=False, floatfmt=".3f"))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# convert completed days of power logs to the binary cache read by the power scripts, and keep a
+# shared power index up to date for get_resource_usage.py --power
+
+import os
+import glob
+import argparse
+import functools
+from datetime import date, timedelta
+from power_utils import GPFS_POWER_ROOT, PowerIndex, cache_file, write_power_cache, read_power_day_cached
+
+
+def get_args():
+
+    parser = argparse.ArgumentParser(description="Convert daily power CSV files to memory mappable binary caches. Only completed days (before today) are converted.")
+    parser.add_argument("-r", "--root", help="Top level directory of the power logs (default: %(default)s)", required=False, default=GPFS_POWER_ROOT)
+    parser.add_argument("-s", "--start", help="First day to convert (format: YYYY-MM-DD). Default is yesterday", required=False, type=date.fromisoformat)
+    parser.add_argument("-e", "--end", help="Last day to convert (format: YYYY-MM-DD). Default is yesterday", required=False, type=date.fromisoformat)
+    parser.add_argument("-c", "--cache-dir", help="Shadow the CSV tree under this directory instead of writing next to the CSV files (default: $POWER_CACHE_DIR)", required=False)
+    parser.add_argument("-f", "--force", help="Rebuild caches that are already up to date", required=False, action='store_true')
+    parser.add_argument("-i", "--index", help="Also bring the power index in this directory up to date for every day from --start to today. Run every few minutes from cron and point get_resource_usage.py --power-index (or $POWER_INDEX_DIR) at it, so that only reads what was logged since", required=False)
+    args = parser.parse_args()
+    return(args)
+
+
+def day_files(root, day):
+    # all of the node power logs for one day
+    return(sorted(glob.glob(f'{root}/{day:%Y}/{day:%Y%m}/{day:%m%d}/power_orginfo_*_{day:%Y%m%d}.csv')))
+
+
+def day_ips(root, day):
+    # node IP addresses with a power log on one day, from the file names
+    return([os.path.basename(path).split('_')[2] for path in day_files(root, day)])
+
+
+def is_current(path, cache_dir=None):
+    # the cache is only used by the readers when it is at least as new as the CSV
+    cache = cache_file(path, cache_dir)
+    return(os.path.exists(cache) and os.stat(cache).st_mtime >= os.stat(path).st_mtime)
+
+
+def convert_days(root, start, end, cache_dir=None, force=False):
+    converted = 0
+    skipped = 0
+    day = start
+    while day <= end:
+        # the current day is still being written to, so it is never cached
+        if day >= date.today():
+            break
+        for path in day_files(root, day):
+            if not force and is_current(path, cache_dir):
+                skipped += 1
+                continue
+            write_power_cache(path, cache_dir)
+            converted += 1
+        day += timedelta(days=1)
+    return(converted, skipped)
+
+
+def update_index(root, directory, days, cache_dir=None):
+    # read what every node logged since the previous update, completed days through their binary caches
+    index = PowerIndex(directory, root, reader=functools.partial(read_power_day_cached, cache_dir=cache_dir))
+    for day in days:
+        index.update(day_ips(root, day), [day])
+    return(sum(len(index.load(day)) for day in days))
+
+
+if __name__ == "__main__":
+    args = get_args()
+    yesterday = date.today() - timedelta(days=1)
+    start = args.start or yesterday
+    end = args.end or yesterday
+    converted, skipped = convert_days(args.root, start, end, args.cache_dir, args.force)
+    print(f"Converted {converted} power files between {start} and {end} ({skipped} already up to date)")
+    if args.index:
+        days = [start + timedelta(days=i) for i in range((date.today() - start).days + 1)]
+        indexed = update_index(args.root, args.index, days, args.cache_dir)
+        print(f"Updated the power index in {args.index} ({indexed} node days)")
@@ -0,0 +1,817 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# helpers shared by the power accounting scripts for reading the per node daily power logs
+
+import sys
+import os
+import re
+import json
+from datetime import datetime, timedelta
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from slurm_utils import expand_nodelist
+from profiling import stage
+
+GPFS_POWER_ROOT = '/gpfs/power_monitoring/power'
+LUSTRE_POWER_ROOT = '/lustre/admin/power_monitoring/power'
+
+SECONDS_PER_DAY = 86400
+
+# completed days are converted to a memory mappable binary file holding the parsed samples,
+# either next to the CSV or shadowing the CSV tree under $POWER_CACHE_DIR
+POWER_CACHE_DTYPE = np.dtype([('seconds', '<u4'), ('power', '<f4')])
+POWER_CACHE_SUFFIX = '.npy'
+
+
+def power_file(root, ip_addr, day):
+    """
+    Path of the daily power log for a node IP address.
+    Example: power_file(GPFS_POWER_ROOT, '10.10.9.101', date(2024, 3, 7))
+        -> "/gpfs/power_monitoring/power/2024/202403/0307/power_orginfo_10.10.9.101_20240307.csv"
+    """
+    return f'{root}/{day:%Y}/{day:%Y%m}/{day:%m%d}/power_orginfo_{ip_addr}_{day:%Y%m%d}.csv'
+
+
+def node_ip(node):
+    """
+    IP address used in the power log file names for a compute node.
+    Example: "dn001" -> "10.10.9.101", "dg012" -> "10.10.9.212", "xm007" -> "10.10.9.7"
+    Returns None for node types without power monitoring.
+    """
+    match = re.match(r'(\D+)(\d+)$', node)
+    if not match:
+        return None
+    cpu, j = match.group(1), int(match.group(2))
+    if cpu == 'xm':
+        return f'10.10.9.{j}'
+    if cpu == 'dg':
+        return f'10.10.9.2{j:02d}'
+    if cpu == 'dn':
+        return f'10.10.9.1{j:02d}'
+    return None
+
+
+def days_in_window(start, end):
+    # every calendar day touched by the window between two datetimes
+    day = start.date()
+    while day <= end.date():
+        yield day
+        day += timedelta(days=1)
+
+
+# widest power reading that is still parsed as a number, anything longer is an error message
+MAX_READING_WIDTH = 24
+
+
+def parse_power_bytes(data):
+    """
+    Parse the raw bytes of a daily power log with the fixed "HH:MM:SS,<watts|error text>" layout.
+    The times are turned into seconds since midnight and the readings into floats with
+    arithmetic on whole byte arrays, so no Python object is created per row.
+    Plain decimal readings are parsed on whole arrays, the few other short readings (surrounding
+    spaces, exponents) go through pd.to_numeric like before, and anything else (error messages)
+    becomes NaN. Lines without a valid time stamp are dropped.
+    """
+    if data.size == 0:
+        return(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+    # line boundaries, allowing for a missing newline at the end of the file and for \r\n line endings
+    ends = np.flatnonzero(data == ord('\n'))
+    if ends.size == 0 or ends[-1] != data.size - 1:
+        ends = np.append(ends, data.size)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    crlf = (ends > starts) & (data[np.maximum(ends - 1, 0)] == ord('\r'))
+    ends = ends - crlf
+    starts, ends = starts[ends - starts >= 9], ends[ends - starts >= 9]
+
+    # time stamp: fixed positions in the first 9 bytes of every line
+    stamp = data[starts[:, None] + np.arange(9)]
+    digits = stamp[:, [0, 1, 3, 4, 6, 7]].astype(np.int32) - ord('0')
+    good = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    good &= (stamp[:, 2] == ord(':')) & (stamp[:, 5] == ord(':')) & (stamp[:, 8] == ord(','))
+    digits, starts, ends = digits[good], starts[good], ends[good]
+    seconds = ((digits[:, 0] * 10 + digits[:, 1]) * 3600 + (digits[:, 2] * 10 + digits[:, 3]) * 60 + digits[:, 4] * 10 + digits[:, 5]).astype(np.int64)
+
+    # reading: pad every field that could be a number to the same width and parse them all at once
+    field_start = starts + 9
+    field_len = ends - field_start
+    candidate = field_len <= MAX_READING_WIDTH
+    width = int(field_len[candidate].max(initial=0))
+    power = np.full(len(seconds), np.nan)
+    if width == 0:
+        return(seconds, power)
+    cols = np.arange(width)
+    inside = cols < field_len[:, None]
+    field = np.where(inside, data[np.minimum(field_start[:, None] + cols, data.size - 1)], 0)
+    is_digit = (field >= ord('0')) & (field <= ord('9'))
+    is_dot = field == ord('.')
+    is_sign = (cols == 0) & ((field == ord('-')) | (field == ord('+')))
+    numeric = candidate & (is_digit | is_dot | is_sign | ~inside).all(axis=1)
+    # keep the integer below 2**53 so the division below is exact
+    numeric &= (is_dot.sum(axis=1) <= 1) & is_digit.any(axis=1) & (is_digit.sum(axis=1) <= 15)
+    # all of the digits as one integer, then divided by 10 ** (number of decimals),
+    # walking the (few) columns while every step covers all of the rows
+    mantissa = np.zeros(len(seconds), dtype=np.int64)
+    decimals = np.zeros(len(seconds), dtype=np.int64)
+    seen_dot = np.zeros(len(seconds), dtype=bool)
+    for col in range(width):
+        digit = is_digit[:, col]
+        mantissa = np.where(digit, mantissa * 10 + field[:, col] - ord('0'), mantissa)
+        decimals += digit & seen_dot
+        seen_dot |= is_dot[:, col]
+    value = mantissa / 10.0 ** decimals
+    value = np.where(field[:, 0] == ord('-'), -value, value)
+    power[numeric] = value[numeric]
+    # the readings that are not plain decimals but short enough to be a number, e.g. " 451" or "4.5e2",
+    # get the pd.to_numeric conversion of the old pandas reader, row by row but only for these rows
+    other = np.flatnonzero(candidate & ~numeric & (field_len > 0))
+    if other.size:
+        text = [data[field_start[i]:ends[i]].tobytes().decode('ascii', 'replace') for i in other]
+        power[other] = pd.to_numeric(pd.Series(text, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+    return(seconds, power)
+
+
+def read_power_day(path):
+    """
+    Read one daily power log into two numpy arrays sorted by time:
+    seconds since midnight and power in W (error messages become NaN).
+    """
+    with open(path, 'rb') as f:
+        data = np.frombuffer(f.read(), dtype=np.uint8)
+    seconds, power = parse_power_bytes(data)
+    if len(seconds) > 1 and not (np.diff(seconds) >= 0).all():
+        order = np.argsort(seconds, kind='stable')
+        seconds, power = seconds[order], power[order]
+    return(seconds, power)
+
+
+def cache_file(path, cache_dir=None):
+    """
+    Location of the binary cache for a daily power log.
+    Example: "/gpfs/.../power_orginfo_10.10.9.101_20240307.csv"
+        -> "/gpfs/.../power_orginfo_10.10.9.101_20240307.csv.npy"
+        -> "<cache_dir>/gpfs/.../power_orginfo_10.10.9.101_20240307.csv.npy" when a cache directory is set
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get('POWER_CACHE_DIR')
+    if cache_dir:
+        path = os.path.join(cache_dir, os.path.abspath(path).lstrip(os.sep))
+    return path + POWER_CACHE_SUFFIX
+
+
+def write_power_cache(path, cache_dir=None):
+    # parse one daily power log and store its samples as a binary file, returns the cache path
+    seconds, power = read_power_day(path)
+    samples = np.empty(len(seconds), dtype=POWER_CACHE_DTYPE)
+    samples['seconds'] = seconds
+    samples['power'] = power
+    cache = cache_file(path, cache_dir)
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    # write to a temporary file first so readers never see a half written cache
+    tmp = f'{cache}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, samples)
+    os.replace(tmp, cache)
+    return(cache)
+
+
+def load_power_cache(cache):
+    # memory map the cache so only the pages holding the requested window are read
+    samples = np.load(cache, mmap_mode='r')
+    return(samples['seconds'], samples['power'])
+
+
+def read_power_day_cached(path, cache_dir=None):
+    """
+    Same as read_power_day, but use the binary cache whenever it is newer than the CSV
+    (or the CSV is gone) so repeated queries skip parsing entirely.
+    """
+    cache = cache_file(path, cache_dir)
+    try:
+        cache_mtime = os.stat(cache).st_mtime
+    except FileNotFoundError:
+        return(read_power_day(path))
+    try:
+        source_mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        source_mtime = 0
+    if cache_mtime >= source_mtime:
+        return(load_power_cache(cache))
+    return(read_power_day(path))
+
+
+def window_slice(seconds, power, start_sec, end_sec):
+    """
+    Samples strictly inside (start_sec, end_sec), found by a binary search on the
+    sorted time column so the cost does not depend on the size of the day.
+    """
+    lo = np.searchsorted(seconds, start_sec, side='right')
+    hi = np.searchsorted(seconds, end_sec, side='left')
+    return(seconds[lo:hi], power[lo:hi])
+
+
+def iter_power_window(root, ip_addr, start, end, reader=read_power_day_cached):
+    """
+    Lazily walk the daily power logs touched by the [start, end] window of a job.
+    Yields (day, seconds since start, power) for every file, so a job that crosses
+    midnight or runs for several days reads each of its files in turn.
+    """
+    for day in days_in_window(start, end):
+        midnight = datetime.combine(day, datetime.min.time())
+        # the first and last day are cut at the job start and end, the days in between are read whole
+        start_sec = (start - midnight).total_seconds() if day == start.date() else -1.0
+        end_sec = (end - midnight).total_seconds() if day == end.date() else float(SECONDS_PER_DAY)
+        path = power_file(root, ip_addr, day)
+        try:
+            with stage('csv_load') as loaded:
+                seconds, power = reader(path)
+                loaded.rows = len(seconds)
+        except FileNotFoundError:
+            print(f'Warning: no power data for {ip_addr} on {day}: {path}', file=sys.stderr)
+            continue
+        with stage('window_slice') as sliced:
+            seconds, power = window_slice(seconds, power, start_sec, end_sec)
+            sliced.rows = len(seconds)
+        offset = (midnight - start).total_seconds()
+        yield(day, seconds + offset, power)
+
+
+def read_power_window(root, ip_addr, start, end, reader=read_power_day_cached):
+    # concatenate all of the daily slices for one node into (seconds since start, power)
+    pieces = list(iter_power_window(root, ip_addr, start, end, reader=reader))
+    if not pieces:
+        return(np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64))
+    seconds = np.concatenate([piece[1] for piece in pieces])
+    power = np.concatenate([piece[2] for piece in pieces]).astype(np.float64)
+    return(seconds, power)
+
+
+# integration policies: short gaps (up to max_gap seconds) between samples are bridged by
+# interpolation, longer gaps and missing nodes are filled by gap_fill and counted as not bridged
+INTERPOLATION_POLICIES = ('linear', 'previous')
+GAP_FILL_POLICIES = ('mean', 'zero', 'nan')
+RAMP_POLICIES = ('mean', 'drop')
+DEFAULT_MAX_GAP = 300.0
+
+# cumulative energy (J) and covered time (s) of one power file at every knot of its interpolated power curve
+# with the times of the valid samples and error readings, and the file's median sampling interval
+PowerPrefix = namedtuple('PowerPrefix', ['times', 'values', 'slopes', 'bridged', 'energy', 'covered', 'samples', 'errors', 'interval'])
+
+
+def add_integration_args(parser, ramp=0.0):
+    # command line options for the integration policies shared by the power scripts
+    parser.add_argument("--max-gap", help="Longest gap in seconds between two samples that is bridged by --interpolation (default: %(default)s)", required=False, type=float, default=DEFAULT_MAX_GAP)
+    parser.add_argument("--interpolation", help="How short gaps are bridged (default: %(default)s)", required=False, choices=INTERPOLATION_POLICIES, default='linear')
+    parser.add_argument("--gap-fill", help="How gaps longer than --max-gap are filled: with the node's average power, zero, or not at all which makes the energy NaN (default: %(default)s)", required=False, choices=GAP_FILL_POLICIES, default='mean')
+    parser.add_argument("--ramp", help="Seconds at the start and end of the window that are excluded as ramp up/down (default: %(default)s)", required=False, type=float, default=ramp)
+    parser.add_argument("--ramp-policy", help="Replace the ramp with the node's average power over the rest of the window or drop it from the energy (default: %(default)s)", required=False, choices=RAMP_POLICIES, default='mean')
+
+
+def integration_options(args):
+    # the integration keyword arguments of job_reports, batch_energy and benchmark_table from the parsed add_integration_args options
+    return({'max_gap': args.max_gap, 'interpolation': args.interpolation,
+            'gap_fill': args.gap_fill, 'ramp': args.ramp, 'ramp_policy': args.ramp_policy})
+
+
+def confidence(coverage):
+    # label for how much of a window is backed by real samples
+    if coverage >= 0.95:
+        return('high')
+    if coverage >= 0.8:
+        return('medium')
+    if coverage > 0:
+        return('low')
+    return('none')
+
+
+def power_prefix(seconds, power, max_gap=DEFAULT_MAX_GAP, interpolation='linear', low=0.0, high=float(SECONDS_PER_DAY)):
+    """
+    Prefix sums of the power curve of one file, built once so the energy of any window of the file is
+    two lookups (see prefix_at). Error readings (NaN) are dropped, consecutive samples up to max_gap
+    apart are bridged by linear or previous-value interpolation and the first and last sample are
+    held for up to max_gap before and after them, but never past low and high (the day's midnights).
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    power = np.asarray(power, dtype=np.float64)
+    valid = ~np.isnan(power)
+    times, values = seconds[valid], power[valid]
+    if len(times):
+        head = [max(low, times[0] - max_gap)] if times[0] > low else []
+        tail = [min(high, times[-1] + max_gap)] if times[-1] < high else []
+        times = np.concatenate((head, times, tail))
+        values = np.concatenate((values[:1] if head else [], values, values[-1:] if tail else []))
+    widths = np.diff(times)
+    bridged = widths <= max_gap
+    if interpolation == 'linear':
+        slopes = np.divide(np.diff(values), widths, out=np.zeros(len(widths)), where=widths > 0)
+    else:
+        slopes = np.zeros(len(widths))
+    segments = np.where(bridged, values[:-1] * widths + slopes * widths * widths / 2.0, 0.0)
+    energy = np.concatenate(([0.0], np.cumsum(segments)))
+    covered = np.concatenate(([0.0], np.cumsum(np.where(bridged, widths, 0.0))))
+    # error readings are attempts at the logger's cadence too, so they count towards the interval
+    interval = max(float(np.median(np.diff(seconds))), 1.0) if len(seconds) > 1 else float('nan')
+    return(PowerPrefix(times, values, slopes, bridged, energy, covered, seconds[valid], seconds[~valid], interval))
+
+
+def prefix_at(prefix, at):
+    # energy (J) and covered time (s) from the start of the file up to every time in at, found by searchsorted
+    at = np.asarray(at, dtype=np.float64)
+    if len(prefix.times) < 2:
+        return(np.zeros(at.shape), np.zeros(at.shape))
+    knot = np.clip(np.searchsorted(prefix.times, at, side='right') - 1, 0, len(prefix.times) - 2)
+    into = np.clip(at - prefix.times[knot], 0.0, prefix.times[knot + 1] - prefix.times[knot])
+    into = np.where(prefix.bridged[knot], into, 0.0)
+    energy = prefix.energy[knot] + prefix.values[knot] * into + prefix.slopes[knot] * into * into / 2.0
+    return(energy, prefix.covered[knot] + into)
+
+
+def window_days(key, node, ip_addr, start, end, ramp=0.0):
+    """
+    Split one node's window into one row per day with the bounds in seconds since that day's midnight.
+    The steady bounds leave out ramp seconds at both ends of the whole window when it is longer than 2 * ramp.
+    Example: window_days(123, 'dn001', '10.10.9.101', datetime(2024, 3, 7, 23), datetime(2024, 3, 8, 1))
+        -> [(123, 'dn001', '10.10.9.101', date(2024, 3, 7), 82800.0, 86400.0, 82800.0, 86400.0),
+            (123, 'dn001', '10.10.9.101', date(2024, 3, 8), 0.0, 3600.0, 0.0, 3600.0)]
+    """
+    total = (end - start).total_seconds()
+    ramp = ramp if ramp > 0 and total > 2 * ramp else 0.0
+    rows = []
+    for day in days_in_window(start, end):
+        midnight = datetime.combine(day, datetime.min.time())
+        offset = (start - midnight).total_seconds()
+        lo, hi = max(offset, 0.0), min(offset + total, float(SECONDS_PER_DAY))
+        steady_lo, steady_hi = max(offset + ramp, lo), min(offset + total - ramp, hi)
+        rows.append((key, node, ip_addr, day, lo, hi, min(steady_lo, steady_hi), steady_hi))
+    return(rows)
+
+
+WINDOW_COLUMNS = ['JobID', 'Node', 'ip', 'day', 'start_sec', 'end_sec', 'steady_start', 'steady_end']
+
+
+def job_node_days(jobs, ramp=0.0, node_to_ip=node_ip):
+    """
+    window_days of every monitored node of every job in a sacct table (JobID, Start, End, NodeList).
+    Each distinct nodelist is only expanded once.
+    """
+    expanded = {}
+    rows = []
+    for job in jobs.itertuples(index=False):
+        if job.NodeList not in expanded:
+            expanded[job.NodeList] = [(node, node_to_ip(node)) for node in expand_nodelist(job.NodeList)]
+        start, end = job.Start.to_pydatetime(), job.End.to_pydatetime()
+        for node, ip_addr in expanded[job.NodeList]:
+            if ip_addr is not None:
+                rows.extend(window_days(job.JobID, node, ip_addr, start, end, ramp))
+    return(pd.DataFrame(rows, columns=WINDOW_COLUMNS))
+
+
+def window_integrals(windows, root, reader=read_power_day_cached, max_gap=DEFAULT_MAX_GAP, interpolation='linear'):
+    """
+    Energy (J) and covered time (s) of the whole and of the steady part of every window of a
+    window_days table, with the valid samples and error readings inside it and the number of
+    samples expected at the file's median sampling interval (0 for a missing file).
+    The windows are grouped by (node, day), so each power file is read once and its power_prefix
+    built once however many jobs ran on the node that day, and all of the windows that fall in
+    the file are resolved together with prefix_at.
+    """
+    columns = ['energy', 'covered', 'steady_energy', 'steady_covered', 'samples', 'errors', 'expected']
+    results = {column: np.zeros(len(windows)) for column in columns}
+    bounds = {column: windows[column].to_numpy(dtype=np.float64) for column in ['start_sec', 'end_sec', 'steady_start', 'steady_end']}
+    for (ip_addr, day), rows in windows.groupby(['ip', 'day'], sort=False).indices.items():
+        path = power_file(root, ip_addr, day)
+        try:
+            with stage('csv_load') as loaded:
+                seconds, power = reader(path)
+                loaded.rows = len(seconds)
+        except FileNotFoundError:
+            print(f'Warning: no power data for {ip_addr} on {day}: {path}', file=sys.stderr)
+            continue
+        with stage('integrate') as integrated:
+            prefix = power_prefix(seconds, power, max_gap, interpolation)
+            lo, hi = bounds['start_sec'][rows], bounds['end_sec'][rows]
+            energy_lo, covered_lo = prefix_at(prefix, lo)
+            energy_hi, covered_hi = prefix_at(prefix, hi)
+            results['energy'][rows] = energy_hi - energy_lo
+            results['covered'][rows] = covered_hi - covered_lo
+            energy_lo, covered_lo = prefix_at(prefix, bounds['steady_start'][rows])
+            energy_hi, covered_hi = prefix_at(prefix, bounds['steady_end'][rows])
+            results['steady_energy'][rows] = energy_hi - energy_lo
+            results['steady_covered'][rows] = covered_hi - covered_lo
+            results['samples'][rows] = np.searchsorted(prefix.samples, hi, side='left') - np.searchsorted(prefix.samples, lo, side='left')
+            results['errors'][rows] = np.searchsorted(prefix.errors, hi, side='left') - np.searchsorted(prefix.errors, lo, side='left')
+            if len(seconds) > 1:
+                results['expected'][rows] = (hi - lo) / prefix.interval
+            integrated.rows = len(rows)
+    return(windows.assign(**results))
+
+
+def node_energy(windows, gap_fill='mean', ramp_policy='mean'):
+    """
+    Samples, error readings, coverage, average power and energy of every (JobID, Node) of a
+    window_integrals table. Coverage is the share of the samples expected at each file's median
+    sampling interval that have a valid reading, weighted by the time in each file (a missing
+    file counts as none), and Bridged the share of the window within max_gap of a valid sample.
+    The average power is the energy over the bridged steady time, gaps longer than max_gap are
+    filled by gap_fill and the ramps by ramp_policy.
+    """
+    length = windows['end_sec'] - windows['start_sec']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sampled = (windows['samples'] / windows['expected']).clip(upper=1.0).fillna(0.0) * length
+    windows = windows.assign(length=length, steady=windows['steady_end'] - windows['steady_start'], sampled=sampled)
+    sums = ['length', 'steady', 'covered', 'sampled', 'steady_energy', 'steady_covered', 'samples', 'errors']
+    nodes = windows.groupby(['JobID', 'Node'], sort=False)[sums].sum().reset_index()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (nodes['steady_energy'] / nodes['steady_covered']).to_numpy()
+        coverage = (nodes['sampled'] / nodes['length']).fillna(0.0).to_numpy()
+        bridged = (nodes['covered'] / nodes['length']).fillna(0.0).to_numpy()
+    gap = (nodes['steady'] - nodes['steady_covered']).to_numpy()
+    ramp = (nodes['length'] - nodes['steady']).to_numpy()
+    energy = nodes['steady_energy'].to_numpy()
+    gapped = gap > 1e-6
+    if gap_fill == 'mean':
+        energy = energy + np.where(gapped, mean * gap, 0.0)
+    elif gap_fill == 'nan':
+        energy = np.where(gapped, np.nan, energy)
+    if ramp_policy == 'mean':
+        energy = energy + np.where(ramp > 0, mean * ramp, 0.0)
+    report = pd.DataFrame({
+        "JobID": nodes['JobID'],
+        "Node": nodes['Node'],
+        "Samples": nodes['samples'].astype(np.int64),
+        "Error readings": nodes['errors'].astype(np.int64),
+        "Coverage (%)": coverage * 100.0,
+        "Bridged (%)": bridged * 100.0,
+        "Average power (W)": mean,
+        "Energy (Wh)": energy / 3600.0,
+        "Confidence": [confidence(c) for c in coverage],
+    })
+    return(report)
+
+
+def job_reports(jobs, root=GPFS_POWER_ROOT, reader=read_power_day_cached, max_gap=DEFAULT_MAX_GAP, interpolation='linear',
+                gap_fill='mean', ramp=0.0, ramp_policy='mean'):
+    """
+    One row per monitored node of every job in a sacct table (JobID, Start, End, NodeList) with its
+    samples, coverage and bridged share (see node_energy), average power, energy and a confidence
+    label based on the coverage. Every power file is read once for all of the jobs (see window_integrals).
+    """
+    jobs = jobs.dropna(subset=['Start', 'End'])
+    windows = job_node_days(jobs, ramp)
+    windows = window_integrals(windows, root, reader, max_gap, interpolation)
+    return(node_energy(windows, gap_fill, ramp_policy))
+
+
+def job_totals(reports, gap_fill='mean'):
+    """
+    Power (W), energy (Wh), nodes with data and coverage (%) of every job of a job_reports table.
+    With gap_fill 'nan' a node whose gaps were left unfilled (NaN) makes the job NaN too;
+    otherwise nodes without any usable sample are left out of the totals with a warning.
+    """
+    missing = reports[reports['Energy (Wh)'].isna()]
+    if gap_fill != 'nan':
+        for jobid, nodes in missing.groupby('JobID', sort=False)['Node']:
+            print(f"Warning: no power data on {','.join(nodes)} of job {jobid}, left out of the job's energy", file=sys.stderr)
+    per_job = reports.groupby('JobID', sort=False)
+    totals = pd.DataFrame({'Power (W)': per_job['Average power (W)'].sum(min_count=1),
+                           'Energy (Wh)': per_job['Energy (Wh)'].sum(min_count=1),
+                           'Nodes with data': per_job['Samples'].agg(lambda samples: int((samples > 0).sum())),
+                           'Coverage (%)': per_job['Coverage (%)'].mean()})
+    if gap_fill == 'nan':
+        unfilled = missing['JobID'].unique()
+        totals.loc[totals.index.isin(unfilled), ['Power (W)', 'Energy (Wh)']] = np.nan
+    return(totals)
+
+
+def batch_energy(jobs, root=GPFS_POWER_ROOT, reader=read_power_day_cached, options=None):
+    """
+    Energy used by every job in a sacct table (JobID, Start, End, NodeList), from job_reports and
+    job_totals, so each power file is read once for the whole batch. A single job goes through
+    here too, so it gets the same numbers on its own as in a batch.
+    """
+    options = options or {}
+    jobs = jobs.dropna(subset=['Start', 'End']).reset_index(drop=True)
+    totals = job_totals(job_reports(jobs, root, reader, **options), options.get('gap_fill', 'mean'))
+    table = jobs[['JobID', 'Start', 'End']].copy()
+    table['Nodes'] = jobs['NodeList'].map(lambda nodelist: len(expand_nodelist(nodelist)))
+    table['Nodes with data'] = table['JobID'].map(totals['Nodes with data']).fillna(0).astype(int)
+    table['Duration (h)'] = (jobs['End'] - jobs['Start']).dt.total_seconds() / 60.0 / 60.0
+    for column in ['Power (W)', 'Energy (Wh)', 'Coverage (%)']:
+        table[column] = table['JobID'].map(totals[column])
+    table['Confidence'] = table['Coverage (%)'].fillna(0).map(lambda coverage: confidence(coverage / 100.0))
+    return(table.rename(columns={'JobID': 'Job ID'}))
+
+
+# Regular expressions to find the benchmarks, node name, start, and end times in a benchmark log
+BENCHMARK_PATTERN = re.compile(r'Benchmark (\d+):.*-(p|T|t|@|num_threads) (\d+)')
+NODE_PATTERN = re.compile(r'Node: (.+)')
+START_TIME_PATTERN = re.compile(r'Start Time: (.+)')
+END_TIME_PATTERN = re.compile(r'End Time: (.+)')
+BENCHMARK_TIME_FORMAT = '%m-%d-%y %H:%M:%S'
+
+
+def parse_benchmark_log(path):
+    """
+    Read a benchmark log once and return every benchmark it contains as a dict with
+    benchmark, flag, threads, node, start and end. The node is the last "Node:" line
+    seen before the benchmark (None if the log has none).
+    """
+    records = []
+    node = None
+    current = None
+    with open(path, 'r') as file:
+        for line in file:
+            node_match = NODE_PATTERN.match(line)
+            if node_match:
+                node = node_match.group(1).strip()
+                continue
+            benchmark_match = BENCHMARK_PATTERN.match(line)
+            if benchmark_match:
+                current = {'benchmark': int(benchmark_match.group(1)), 'flag': benchmark_match.group(2),
+                           'threads': int(benchmark_match.group(3)), 'node': node, 'start': None, 'end': None}
+                continue
+            if current is None:
+                continue
+            start_time_match = START_TIME_PATTERN.match(line)
+            if start_time_match:
+                current['start'] = datetime.strptime(start_time_match.group(1).strip().replace('/', '-'), BENCHMARK_TIME_FORMAT)
+            end_time_match = END_TIME_PATTERN.match(line)
+            if end_time_match and current['start'] is not None:
+                current['end'] = datetime.strptime(end_time_match.group(1).strip().replace('/', '-'), BENCHMARK_TIME_FORMAT)
+                records.append(current)
+                current = None
+    return(records)
+
+
+def benchmark_reports(records, root, ip_for, reader=read_power_day_cached, options=None):
+    """
+    node_energy report of every benchmark in a parsed log, indexed by the benchmark's position in records.
+    All of the benchmarks are integrated together, so a power file is read once however many
+    benchmarks fall on the same day. The --ramp at both ends is only excluded when the
+    benchmark ran for at least 5 minutes.
+    """
+    options = dict(options or {})
+    ramp = options.pop('ramp', 0.0)
+    gap_fill = options.pop('gap_fill', 'mean')
+    ramp_policy = options.pop('ramp_policy', 'mean')
+    rows = []
+    for i, record in enumerate(records):
+        ip_addr = ip_for(record['node'])
+        total = (record['end'] - record['start']).total_seconds()
+        rows.extend(window_days(i, ip_addr, ip_addr, record['start'], record['end'], ramp if total >= 300 else 0.0))
+    windows = window_integrals(pd.DataFrame(rows, columns=WINDOW_COLUMNS), root, reader, **options)
+    return(node_energy(windows, gap_fill, ramp_policy).set_index('JobID'))
+
+
+def benchmark_energy(root, ip_addr, start, end, runs=1, reader=read_power_day_cached, options=None):
+    # duration (h), average power (W), energy (Wh), energy per run (Wh) and coverage (%) of one benchmark
+    report = benchmark_reports([{'node': ip_addr, 'start': start, 'end': end}], root, lambda node: node, reader, options).iloc[0]
+    duration = (end - start).total_seconds() / 60.0 / 60.0
+    energy = report['Energy (Wh)']
+    return(duration, report['Average power (W)'], energy, energy / runs, report['Coverage (%)'])
+
+
+def benchmark_table(records, root, ip_for, runs=1, scaling=False, options=None, reader=read_power_day_cached):
+    """
+    Energy of every benchmark in a parsed log, from benchmark_reports. With scaling, speedup and
+    energy-to-solution are added relative to the lowest thread count run with the same flag.
+    """
+    reports = benchmark_reports(records, root, ip_for, reader, options)
+    rows = []
+    for i, record in enumerate(records):
+        report = reports.loc[i]
+        duration = (record['end'] - record['start']).total_seconds() / 60.0 / 60.0
+        energy = report['Energy (Wh)']
+        rows.append((record['benchmark'], record['flag'], record['threads'], record['node'], record['start'], record['end'],
+                     duration, report['Average power (W)'], energy, energy / runs, report['Coverage (%)']))
+    columns = ["Benchmark", "Flag", "Threads", "Node", "Start", "End", "Duration (h)", "Average power (W)", "Energy (Wh)", "Energy per run (Wh)", "Coverage (%)"]
+    table = pd.DataFrame(rows, columns=columns).sort_values(["Flag", "Threads", "Benchmark"], kind='stable')
+    if scaling and len(table):
+        baseline = table.loc[table.groupby("Flag")["Threads"].idxmin()].set_index("Flag")
+        table["Speedup"] = table["Flag"].map(baseline["Duration (h)"]) / table["Duration (h)"]
+        table["Energy-to-solution (kJ)"] = table["Energy per run (Wh)"] * 3.6
+        table["Relative energy-to-solution"] = table["Energy per run (Wh)"] / table["Flag"].map(baseline["Energy per run (Wh)"])
+    return(table)
+
+
+def last_sample(path, chunk=4096):
+    """
+    Newest valid (seconds since midnight, W) sample of a power log, found by seeking to the
+    end of the file and parsing only its last few lines. Returns None if there is none.
+    """
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - chunk, 0))
+        data = f.read()
+    if size > chunk:
+        # the first line of the chunk is probably cut
+        data = data[data.find(b'\n') + 1:]
+    seconds, power = parse_power_bytes(np.frombuffer(data, dtype=np.uint8))
+    valid = np.flatnonzero(~np.isnan(power))
+    if not len(valid):
+        return(None)
+    return(int(seconds[valid[-1]]), float(power[valid[-1]]))
+
+
+class PowerTail:
+    """
+    Follow one node's power logs from a remembered byte offset and keep a running
+    (trapezoidal) energy integral of the samples taken after a start time.
+    Every update only reads the bytes appended since the previous one and moves on to the
+    next day's file once the day is over (unless last_day is set), so a multi-day job is
+    never read twice. With checkpoint_interval the cumulative energy is also recorded every
+    so many seconds, so the energy used after any later time can be looked up.
+    """
+
+    def __init__(self, root, ip_addr, since, reader=read_power_day_cached, last_day=None, checkpoint_interval=None):
+        self.root = root
+        self.ip_addr = ip_addr
+        self.since = since
+        self.reader = reader
+        self.last_day = last_day
+        self.checkpoint_interval = checkpoint_interval
+        self.day = since.date()
+        self.offset = 0
+        self.last_time = None
+        self.last_power = None
+        self.energy = 0.0
+        self.samples = 0
+        self.checkpoints = []
+        self.until = None
+
+    def stop_at(self, until):
+        # ignore the samples taken after until (e.g. the end of the job) and never move past its day
+        self.until = until
+        self.last_day = until.date()
+
+    def _read_day(self, finished):
+        with stage('csv_load') as loaded:
+            new = self._read_new(finished)
+            loaded.rows = 0 if new is None else len(new[0])
+        return(new)
+
+    def _read_new(self, finished):
+        # samples of the current day that have not been seen yet, in seconds since midnight
+        path = power_file(self.root, self.ip_addr, self.day)
+        if finished and self.offset == 0:
+            # a completed day is read whole, through the binary cache when there is one
+            try:
+                new = self.reader(path)
+                self.offset = os.path.getsize(path)
+                return(new)
+            except FileNotFoundError:
+                return(None)
+        try:
+            with open(path, 'rb') as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return(None)
+        # only consume complete lines, a partly written line is read again next time
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        return(parse_power_bytes(np.frombuffer(data[:end], dtype=np.uint8)))
+
+    def _add(self, times, power):
+        valid = ~np.isnan(power)
+        times, power = times[valid], power[valid]
+        if self.last_time is not None:
+            times = np.concatenate(([self.last_time], times))
+            power = np.concatenate(([self.last_power], power))
+        if len(times) > 1:
+            cumulative = self.energy + np.cumsum((power[1:] + power[:-1]) / 2.0 * np.diff(times))
+            if self.checkpoint_interval:
+                # the first sample in every new checkpoint interval
+                bins = times[1:] // self.checkpoint_interval
+                last_bin = self.checkpoints[-1][0] // self.checkpoint_interval if self.checkpoints else -1
+                bins, first = np.unique(bins, return_index=True)
+                first = first[bins > last_bin]
+                self.checkpoints.extend([float(t), float(e)] for t, e in zip(times[1:][first], cumulative[first]))
+            self.energy = float(cumulative[-1])
+        if len(times):
+            self.last_time, self.last_power = float(times[-1]), float(power[-1])
+        self.samples += int(valid.sum())
+
+    def energy_at(self, time):
+        """Energy in J used between the start and a time (seconds since the start), from the checkpoints."""
+        points = self.checkpoints + ([[self.last_time, self.energy]] if self.last_time is not None else [])
+        if not points:
+            return(0.0)
+        points = np.asarray(points)
+        return(float(np.interp(time, points[:, 0], points[:, 1], left=0.0)))
+
+    def state(self):
+        # everything needed to carry on from where the tail stopped, as plain JSON types
+        return({'day': self.day.isoformat(), 'offset': self.offset, 'last_time': self.last_time, 'last_power': self.last_power,
+                'energy': self.energy, 'samples': self.samples, 'checkpoints': self.checkpoints})
+
+    def restore(self, state):
+        self.day = datetime.strptime(state['day'], '%Y-%m-%d').date()
+        self.offset = state['offset']
+        self.last_time = state['last_time']
+        self.last_power = state['last_power']
+        self.energy = state['energy']
+        self.samples = state['samples']
+        self.checkpoints = state['checkpoints']
+        return(self)
+
+    def update(self, now=None):
+        """Read the newly appended samples and return the energy used since the start in Wh."""
+        now = now or datetime.now()
+        while True:
+            finished = self.day < now.date()
+            new = self._read_day(finished)
+            if new is not None:
+                seconds, power = new
+                midnight = datetime.combine(self.day, datetime.min.time())
+                times = np.asarray(seconds, dtype=np.float64) + (midnight - self.since).total_seconds()
+                after = times >= 0
+                if self.until is not None:
+                    after &= times <= (self.until - self.since).total_seconds()
+                self._add(times[after], np.asarray(power, dtype=np.float64)[after])
+            if not finished or (self.last_day is not None and self.day >= self.last_day):
+                break
+            self.day += timedelta(days=1)
+            self.offset = 0
+        return(self.energy / 3600.0)
+
+
+class PowerIndex:
+    """
+    Index of the newest sample and the running energy of every node, kept in one small JSON
+    file per day. Updating it only reads the bytes appended to each node's power log since the
+    previous update, and the cumulative energy checkpoints give the energy used by a node
+    after any time of the day without reading the power log again.
+    """
+
+    def __init__(self, directory, root=GPFS_POWER_ROOT, checkpoint_interval=600, reader=read_power_day_cached):
+        self.directory = directory
+        self.root = root
+        self.reader = reader
+        self.checkpoint_interval = checkpoint_interval
+        self.days = {}
+
+    def path(self, day):
+        return(os.path.join(self.directory, f'power_index_{day:%Y%m%d}.json'))
+
+    def load(self, day):
+        # the tails of one day, empty if the day was never indexed
+        if day not in self.days:
+            try:
+                with open(self.path(day)) as f:
+                    states = json.load(f)
+            except (FileNotFoundError, ValueError):
+                states = {}
+            self.days[day] = {ip_addr: self._tail(ip_addr, day).restore(state) for ip_addr, state in states.items()}
+        return(self.days[day])
+
+    def save(self, day):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(day)
+        # write to a temporary file first so other readers never see a half written index
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({ip_addr: tail.state() for ip_addr, tail in self.days[day].items()}))
+        os.replace(tmp, path)
+
+    def _tail(self, ip_addr, day):
+        midnight = datetime.combine(day, datetime.min.time())
+        return(PowerTail(self.root, ip_addr, midnight, self.reader, last_day=day, checkpoint_interval=self.checkpoint_interval))
+
+    def update(self, ip_addrs, days):
+        """Read the samples appended since the last update for the given nodes and days and save the index."""
+        now = datetime.now()
+        for day in days:
+            tails = self.load(day)
+            before = {ip_addr: tail.offset for ip_addr, tail in tails.items()}
+            for ip_addr in ip_addrs:
+                if ip_addr not in tails:
+                    tails[ip_addr] = self._tail(ip_addr, day)
+                tails[ip_addr].update(now)
+            if all(before.get(ip_addr) == tail.offset for ip_addr, tail in tails.items()):
+                continue
+            if os.path.isdir(self.directory) and not os.access(self.directory, os.W_OK):
+                # a shared index kept up to date by power_cache.py --index, only read from it
+                continue
+            try:
+                self.save(day)
+            except OSError as error:
+                print(f'Warning: could not save the power index {self.path(day)}: {error}', file=sys.stderr)
+
+    def energy_since(self, ip_addr, start, end=None):
+        """Energy in Wh used by a node from start to end (default: its newest sample), NaN if a day was not indexed."""
+        end = end or datetime.now()
+        energy = 0.0
+        for day in days_in_window(start, end):
+            tail = self.load(day).get(ip_addr)
+            if tail is None or tail.last_time is None:
+                return(np.nan)
+            midnight = datetime.combine(day, datetime.min.time())
+            start_sec = max((start - midnight).total_seconds(), 0.0)
+            end_sec = min((end - midnight).total_seconds(), tail.last_time)
+            energy += max(tail.energy_at(end_sec) - tail.energy_at(start_sec), 0.0)
+        return(energy / 3600.0)
+
+
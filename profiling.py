@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# time named stages of a run (wall and CPU time, bytes read, rows, process peak memory) and export them
+# as a JSON summary or a Prometheus textfile for the node-exporter textfile collector
+
+import os
+import sys
+import time
+import json
+import atexit
+import resource
+from datetime import datetime
+
+PROMETHEUS_PREFIX = 'hpc_tools'
+
+
+def read_bytes():
+    """
+    Bytes read by this process so far, from the rchar counter of /proc/self/io.
+    rchar counts every read() (GPFS and Lustre files, pipes from sacct/squeue) whether or not it hit the page cache.
+    Returns 0 where /proc/self/io does not exist.
+    """
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return(int(line.split()[1]))
+    except OSError:
+        pass
+    return(0)
+
+
+# reading /proc/self/io counts towards rchar itself, take that off every stage
+READ_BYTES_OVERHEAD = -(read_bytes() - read_bytes())
+
+
+def peak_rss_mb():
+    # largest resident set size of this process so far (ru_maxrss is in kB on Linux)
+    return(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+
+def child_cpu():
+    # CPU time of the finished child processes (sinfo, squeue, sacct, ssh) so far
+    times = os.times()
+    return(times.children_user + times.children_system)
+
+
+class Stage:
+    """
+    One "with" block of a Profiler. The caller can set rows to the number of rows or samples handled.
+    Example: with profiler.stage("read_file") as stage:
+                 data = read_file(file)
+                 stage.rows = len(data)
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.rows = None
+
+    def __enter__(self):
+        if self.profiler.enabled:
+            self.profiler.stack.append(self.name)
+            # list the stages in the order they start, so outer stages come before the ones inside them
+            self.profiler.totals('/'.join(self.profiler.stack))
+            self.start = (time.perf_counter(), time.process_time(), child_cpu(), read_bytes())
+        return(self)
+
+    def __exit__(self, *exc):
+        if self.profiler.enabled:
+            wall, cpu, children, io = self.start
+            name = '/'.join(self.profiler.stack)
+            self.profiler.stack.pop()
+            self.profiler.add(name, time.perf_counter() - wall, time.process_time() - cpu,
+                              child_cpu() - children, max(read_bytes() - io - READ_BYTES_OVERHEAD, 0), self.rows)
+        return(False)
+
+
+class Profiler:
+    """
+    Totals per named stage. Stages may be nested, the inner ones are named "outer/inner", and a stage
+    that runs several times (e.g. once per power file) is summed over its calls.
+    A disabled profiler (the default) only hands out Stage objects and records nothing.
+    """
+
+    def __init__(self, tool='', enabled=False):
+        self.tool = tool
+        self.enabled = enabled
+        self.started = time.time()
+        self.start = (time.process_time(), child_cpu(), read_bytes())
+        self.stack = []
+        self.stages = {}
+
+    def stage(self, name):
+        return(Stage(self, name))
+
+    def totals(self, name):
+        return(self.stages.setdefault(name, {'stage': name, 'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'child_cpu_s': 0.0,
+                                             'bytes_read': 0, 'rows': None, 'process_peak_rss_mb': 0.0}))
+
+    def add(self, name, wall, cpu, children, io, rows):
+        totals = self.totals(name)
+        totals['calls'] += 1
+        totals['wall_s'] += wall
+        totals['cpu_s'] += cpu
+        totals['child_cpu_s'] += children
+        totals['bytes_read'] += io
+        if rows is not None:
+            totals['rows'] = (totals['rows'] or 0) + int(rows)
+        # ru_maxrss only grows, so this is the peak of the whole process up to the end of the stage and not
+        # the memory of the stage itself: a stage that allocates less than an earlier one shows the earlier peak
+        totals['process_peak_rss_mb'] = peak_rss_mb()
+
+    def summary(self):
+        # the run totals count from when the profiler was created, i.e. after the imports
+        cpu, children, io = self.start
+        return({'tool': self.tool,
+                'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'wall_s': time.time() - self.started,
+                'cpu_s': time.process_time() - cpu,
+                'child_cpu_s': child_cpu() - children,
+                'bytes_read': read_bytes() - io,
+                'peak_rss_mb': peak_rss_mb(),
+                'stages': list(self.stages.values())})
+
+    def write_json(self, path):
+        # "-" writes to stderr so the summary does not get mixed into the tool's own output
+        text = json.dumps(self.summary(), indent=2)
+        if path == '-':
+            print(text, file=sys.stderr)
+        else:
+            with open(path, 'w') as f:
+                f.write(text + '\n')
+
+    def prometheus(self):
+        """
+        The summary in the Prometheus text format, one gauge per stage counter.
+        Example line: hpc_tools_stage_wall_seconds{tool="get_resource_usage",stage="node_stats"} 0.412
+        """
+        summary = self.summary()
+        tool = f'tool="{self.tool}"'
+        metrics = [('stage_wall_seconds', 'wall_s', 'Wall time of the stage in the last run'),
+                   ('stage_cpu_seconds', 'cpu_s', 'CPU time of the tool itself during the stage in the last run'),
+                   ('stage_child_cpu_seconds', 'child_cpu_s', 'CPU time of the commands run during the stage in the last run'),
+                   ('stage_read_bytes', 'bytes_read', 'Bytes read during the stage in the last run'),
+                   ('stage_rows', 'rows', 'Rows handled by the stage in the last run'),
+                   ('stage_calls', 'calls', 'Times the stage ran in the last run')]
+        lines = []
+        for metric, key, description in metrics:
+            lines.append(f'# HELP {PROMETHEUS_PREFIX}_{metric} {description}')
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{metric} gauge')
+            for stage in summary['stages']:
+                if stage[key] is not None:
+                    lines.append(f'{PROMETHEUS_PREFIX}_{metric}{{{tool},stage="{stage["stage"]}"}} {stage[key]}')
+        for metric, value, description in [('run_wall_seconds', summary['wall_s'], 'Wall time of the last run'),
+                                           ('peak_rss_bytes', int(summary['peak_rss_mb'] * 1024 * 1024), 'Peak resident memory of the last run'),
+                                           ('last_run_timestamp_seconds', self.started, 'Start of the last run')]:
+            lines.append(f'# HELP {PROMETHEUS_PREFIX}_{metric} {description}')
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{metric} gauge')
+            lines.append(f'{PROMETHEUS_PREFIX}_{metric}{{{tool}}} {value}')
+        return('\n'.join(lines) + '\n')
+
+    def write_prometheus(self, path):
+        # the textfile collector may read at any time, so write a temporary file and rename it into place
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+
+# the profiler of this run, shared by the scripts and power_utils
+PROFILER = Profiler()
+
+
+def stage(name):
+    return(PROFILER.stage(name))
+
+
+def add_profile_args(parser):
+    # the --profile options shared by the scripts, none of them takes an optional value so they never swallow a positional argument
+    parser.add_argument("--profile", help="Print a JSON summary of the time, CPU, bytes read and rows of every stage, and the process peak RSS at the end of each stage, to stderr",
+                        required=False, action='store_true')
+    parser.add_argument("--profile-json", help="Write the JSON summary of --profile to PATH instead of stderr",
+                        required=False, metavar='PATH')
+    parser.add_argument("--profile-prom", help="Also write the stage metrics to PATH in the Prometheus textfile format (e.g. for the node-exporter textfile collector)",
+                        required=False, metavar='PATH')
+
+
+def start_profile(args, tool):
+    """
+    Turn on the profiler when --profile, --profile-json or --profile-prom was given and write the results when the script exits.
+    Example: start_profile(args, "get_resource_usage")
+    """
+    if not args.profile and args.profile_json is None and args.profile_prom is None:
+        return
+    PROFILER.tool = tool
+    PROFILER.enabled = True
+
+    def finish():
+        if args.profile_json is not None:
+            PROFILER.write_json(args.profile_json)
+        elif args.profile:
+            PROFILER.write_json('-')
+        if args.profile_prom is not None:
+            PROFILER.write_prometheus(args.profile_prom)
+
+    atexit.register(finish)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# helpers shared by the scripts that talk to Slurm
+
+import re
+import subprocess
+import pandas as pd
+
+SACCT = 'sacct'
+
+
+def expand_nodelist(nodelist):
+    """
+    Expand the nodelist to handle ranges and comma-separated lists.
+    Example: "dg[035-036,042]" -> ["dg035", "dg036", "dg042"]
+             "dg[035-036],dn001" -> ["dg035", "dg036", "dn001"]
+    """
+    # split on the commas that are not inside of brackets
+    groups = re.findall(r'[^,\[]+(?:\[[^\]]*\])?', nodelist)
+    if len(groups) > 1:
+        return [node for group in groups for node in expand_nodelist(group)]
+
+    pattern = re.compile(r'(\D+)\[(.+)\]')
+    match = pattern.match(nodelist)
+
+    if not match:
+        return [nodelist]
+
+    prefix, ranges = match.groups()
+    nodes = []
+
+    for part in ranges.split(','):
+        if '-' in part:
+            start, end = part.split('-')
+            nodes.extend([f"{prefix}{str(i).zfill(len(start))}" for i in range(int(start), int(end) + 1)])
+        else:
+            nodes.append(f"{prefix}{part}")
+    return(nodes)
+
+
+SACCT_FIELDS = ['JobID', 'User', 'Start', 'End', 'AllocNodes', 'AllocCPUS', 'NodeList', 'State']
+# the fields needed from a saved sacct dump
+SACCT_DUMP_FIELDS = ['JobID', 'User', 'Start', 'End', 'NodeList', 'AllocCPUS']
+
+
+def parse_sacct(lines, fields=SACCT_FIELDS):
+    """
+    Turn the lines of "sacct -P" output into one row per job allocation, with Start and End as datetimes.
+    Jobs that have not started or ended yet have NaT in Start or End.
+    """
+    rows = [line.rstrip('\r\n').split('|') for line in lines if line.strip()]
+    for number, row in enumerate(rows, start=1):
+        if len(row) != len(fields):
+            raise ValueError(f"sacct line {number} has {len(row)} fields, expected {len(fields)}: {'|'.join(fields)}")
+    df = pd.DataFrame(rows, columns=fields)
+    # job steps (123.batch, 123.0) repeat the allocation they belong to
+    if 'JobID' in df.columns:
+        df = df[~df['JobID'].str.contains('.', regex=False)].reset_index(drop=True)
+    # sacct prints "Unknown" or "None" for the times of jobs that are still pending or running
+    for column in ['Start', 'End']:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], format='%Y-%m-%dT%H:%M:%S', errors='coerce')
+    for column in ['AllocNodes', 'AllocCPUS']:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+    return(df)
+
+
+def sacct_jobs(jobs=None, start=None, end=None, all_users=True):
+    """
+    Run a single sacct query for a list of job IDs or for every job in a date range.
+    Returns one row per job allocation, see parse_sacct.
+    """
+    cmd = [SACCT, '-X', '-P', '--noheader', f'--format={",".join(SACCT_FIELDS)}']
+    if jobs:
+        cmd += ['-j', ','.join(str(job) for job in jobs)]
+    if start is not None:
+        cmd += ['-S', str(start)]
+    if end is not None:
+        # a bare date is midnight for sacct, so run up to the end of that day
+        cmd += ['-E', f'{end}T23:59:59']
+    if all_users and not jobs:
+        cmd += ['-a']
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return(parse_sacct(result.stdout.split('\n')))
+
+
+def read_sacct_dump(path):
+    """
+    Read jobs saved with "sacct -P" to a file, e.g.
+    sacct -a -X -P -S 2024-01-01 --format=JobID,User,Start,End,NodeList,AllocCPUS > jobs.txt
+    With a header line the columns can be in any order as long as SACCT_DUMP_FIELDS are there.
+    Without one (--noheader) the fields must be exactly SACCT_DUMP_FIELDS or SACCT_FIELDS, in that order.
+    Raises ValueError describing the expected format for anything else.
+    """
+    with open(path) as f:
+        lines = [line for line in f if line.strip()]
+    if not lines:
+        return(parse_sacct([], SACCT_DUMP_FIELDS))
+    first = lines[0].rstrip('\r\n').split('|')
+    if first[0] == 'JobID':
+        missing = [field for field in SACCT_DUMP_FIELDS if field not in first]
+        if missing:
+            raise ValueError(f"{path}: the sacct header has no {', '.join(missing)} field(s), "
+                             f"dump the jobs with --format={','.join(SACCT_DUMP_FIELDS)}")
+        return(parse_sacct(lines[1:], first))
+    for fields in (SACCT_DUMP_FIELDS, SACCT_FIELDS):
+        if len(first) == len(fields):
+            return(parse_sacct(lines, fields))
+    raise ValueError(f"{path}: expected {len(SACCT_DUMP_FIELDS)} fields per line without a header "
+                     f"(--format={','.join(SACCT_DUMP_FIELDS)}), found {len(first)}")
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# the tools are flat scripts at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def power_root(tmp_path):
+    """
+    Empty power log tree and a function that writes one node's day into it.
+    Example: power_root.write("10.10.9.101", date(2024, 3, 7), range(0, 86400, 10), 450.0)
+    """
+    from power_utils import power_file
+
+    class PowerRoot(str):
+        def write(self, ip_addr, day, seconds, power):
+            path = power_file(self, ip_addr, day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            readings = power if isinstance(power, (list, tuple)) else [power] * len(seconds)
+            with open(path, 'w') as f:
+                for second, reading in zip(seconds, readings):
+                    f.write(f'{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d},{reading}\n')
+            return(path)
+
+    root = tmp_path / 'power'
+    root.mkdir()
+    return PowerRoot(root)
@@ -0,0 +1,52 @@
+import time
+
+from fanout import LocalTransport, fan_out
+
+
+def statuses(table):
+    return dict(zip(table["Node"], table["Status"]))
+
+
+def test_ok_and_error():
+    probe = 'if [ "$FANOUT_HOST" = dn002 ]; then echo broken >&2; exit 3; fi; echo "$FANOUT_HOST up"'
+    table = fan_out(["dn001", "dn002"], probe, LocalTransport(), max_workers=2).set_index("Node")
+    assert table.loc["dn001", "Status"] == "ok"
+    assert table.loc["dn001", "Output"] == "dn001 up"
+    assert table.loc["dn001", "Return code"] == 0
+    assert table.loc["dn002", "Status"] == "error"
+    assert table.loc["dn002", "Output"] == "broken"
+    assert table.loc["dn002", "Return code"] == 3
+
+
+def test_timeout_kills_the_slow_node():
+    probe = 'if [ "$FANOUT_HOST" = dn002 ]; then sleep 30; fi; echo done'
+    start = time.monotonic()
+    table = fan_out(["dn001", "dn002"], probe, LocalTransport(), max_workers=2, timeout=0.5)
+    assert time.monotonic() - start < 10
+    assert statuses(table) == {"dn001": "ok", "dn002": "timeout"}
+
+
+def test_deadline_reports_stragglers():
+    # dn002 is running when the deadline passes, dn003 and dn004 never get a worker
+    probe = 'if [ "$FANOUT_HOST" != dn001 ]; then sleep 30; fi; echo done'
+    start = time.monotonic()
+    table = fan_out(["dn001", "dn002", "dn003", "dn004"], probe, LocalTransport(), max_workers=2, timeout=60, deadline=1.0)
+    assert time.monotonic() - start < 10
+    assert statuses(table) == {"dn001": "ok", "dn002": "straggler", "dn003": "straggler", "dn004": "straggler"}
+
+
+def test_at_most_max_workers_run_at_once(tmp_path):
+    # every probe leaves a file while it runs and writes down how many it saw
+    running = tmp_path / "running"
+    running.mkdir()
+    probe = (f'touch {running}/$FANOUT_HOST; ls {running} | wc -l > {tmp_path}/$FANOUT_HOST.seen; '
+             f'sleep 0.3; rm {running}/$FANOUT_HOST')
+    nodes = [f"dn{i:03d}" for i in range(1, 7)]
+    start = time.monotonic()
+    table = fan_out(nodes, probe, LocalTransport(), max_workers=2)
+    elapsed = time.monotonic() - start
+    assert set(table["Status"]) == {"ok"}
+    seen = [int((tmp_path / f"{node}.seen").read_text()) for node in nodes]
+    assert max(seen) <= 2
+    # six probes of 0.3 s two at a time take at least three rounds
+    assert elapsed >= 3 * 0.3
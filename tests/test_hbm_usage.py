@@ -0,0 +1,66 @@
+import pytest
+
+import hbm_usage
+
+# two DDR nodes with CPUs and two CPU-less HBM nodes, sizes in kB
+NODES = {0: ('0-55', 268435456, 134217728), 1: ('56-111', 268435456, 134217728),
+         2: ('', 16777216, 12582912), 3: ('', 16777216, 4194304)}
+
+
+def make_node(root, node, cpulist, total_kb, free_kb):
+    path = root / 'sys' / 'devices' / 'system' / 'node' / f'node{node}'
+    path.mkdir(parents=True)
+    (path / 'cpulist').write_text(f'{cpulist}\n')
+    (path / 'meminfo').write_text(f'Node {node} MemTotal:       {total_kb} kB\n'
+                                  f'Node {node} MemFree:        {free_kb} kB\n'
+                                  f'Node {node} MemUsed:        {total_kb - free_kb} kB\n')
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+    for node, values in NODES.items():
+        make_node(tmp_path, node, *values)
+    return tmp_path
+
+
+def test_hbm_nodes_without_dax_are_the_cpu_less_nodes(sysfs):
+    assert hbm_usage.numa_nodes(str(sysfs)) == [0, 1, 2, 3]
+    assert hbm_usage.hbm_nodes(str(sysfs)) == [2, 3]
+
+
+def test_hbm_nodes_from_dax_target_node(sysfs):
+    for name, target in (('dax0.0', '3'), ('dax1.0', '-1')):
+        device = sysfs / 'sys' / 'bus' / 'dax' / 'devices' / name
+        device.mkdir(parents=True)
+        (device / 'target_node').write_text(f'{target}\n')
+    assert hbm_usage.hbm_nodes(str(sysfs)) == [3]
+
+
+def test_node_meminfo_and_hbm_totals(sysfs):
+    assert hbm_usage.node_meminfo(2, str(sysfs)) == {'MemTotal': 16777216, 'MemFree': 12582912, 'MemUsed': 4194304}
+    assert hbm_usage.hbm_usage(str(sysfs)) == {'total_mb': 32768.0, 'used_mb': 16384.0, 'free_mb': 16384.0}
+
+
+def test_parse_numa_stat_cgroup_v2(tmp_path):
+    # bytes per node, only the anon and file counters count
+    path = tmp_path / 'memory.numa_stat'
+    path.write_text('anon N0=4096 N1=0 N2=8192\n'
+                    'file N0=1024 N1=2048 N2=0\n'
+                    'kernel_stack N0=99999 N1=0 N2=0\n')
+    assert hbm_usage.parse_numa_stat(str(path), 4096) == {0: 5120, 1: 2048, 2: 8192}
+
+
+def test_parse_numa_stat_cgroup_v1(tmp_path):
+    # pages per node, only the total line counts
+    path = tmp_path / 'memory.numa_stat'
+    path.write_text('total=12 N0=10 N1=0 N2=2\n'
+                    'file=5 N0=5 N1=0 N2=0\n'
+                    'hierarchical_total=12 N0=10 N1=0 N2=2\n')
+    assert hbm_usage.parse_numa_stat(str(path), 4096) == {0: 40960, 1: 0, 2: 8192}
+
+
+def test_job_hbm_usage_cgroup_v2(sysfs):
+    job = sysfs / 'sys' / 'fs' / 'cgroup' / 'system.slice' / 'slurmstepd.scope' / 'job_123'
+    job.mkdir(parents=True)
+    (job / 'memory.numa_stat').write_text(f'anon N0={1024 ** 3} N2={2 * 1024 ** 3}\nfile N3={1024 ** 3}\n')
+    assert hbm_usage.job_hbm_usage(str(sysfs)) == [{'Job ID': '123', 'HBM used (MB)': 3072.0, 'Memory used (MB)': 4096.0}]
@@ -0,0 +1,95 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from power_utils import batch_energy, job_reports
+
+DN001 = "10.10.9.101"
+DAY = date(2024, 3, 7)
+
+
+def jobs(*rows):
+    df = pd.DataFrame(rows, columns=["JobID", "Start", "End", "NodeList"])
+    df["Start"] = pd.to_datetime(df["Start"])
+    df["End"] = pd.to_datetime(df["End"])
+    return df
+
+
+def test_constant_power_across_midnight(power_root):
+    power_root.write(DN001, date(2024, 3, 7), range(0, 86400, 10), 200.0)
+    power_root.write(DN001, date(2024, 3, 8), range(0, 86400, 10), 200.0)
+    table = batch_energy(jobs(("100", "2024-03-07 23:00:00", "2024-03-08 01:00:00", "dn001")), power_root)
+    assert table.loc[0, "Energy (Wh)"] == pytest.approx(400.0)
+    assert table.loc[0, "Power (W)"] == pytest.approx(200.0)
+    assert table.loc[0, "Coverage (%)"] == pytest.approx(100.0)
+    assert table.loc[0, "Confidence"] == "high"
+
+
+@pytest.mark.parametrize("gap_fill, energy", [("mean", 200.0), ("zero", 100.0), ("nan", np.nan)])
+def test_gap_fill(power_root, gap_fill, energy):
+    # 100 W every 10 s, with the hour from 11:00 missing from the log
+    power_root.write(DN001, DAY, [s for s in range(0, 86400, 10) if not 39600 < s < 43200], 100.0)
+    report = job_reports(jobs(("100", "2024-03-07 10:00:00", "2024-03-07 12:00:00", "dn001")), power_root,
+                         gap_fill=gap_fill).iloc[0]
+    np.testing.assert_allclose(report["Energy (Wh)"], energy, rtol=1e-3)
+    assert report["Average power (W)"] == pytest.approx(100.0)
+    # 361 of the 720 samples expected every 10 s, and a gap longer than --max-gap is not bridged at all
+    assert report["Samples"] == 361
+    assert report["Coverage (%)"] == pytest.approx(100.0 * 361 / 720)
+    assert report["Bridged (%)"] == pytest.approx(50.0)
+    assert report["Confidence"] == "low"
+
+
+@pytest.mark.parametrize("ramp_policy, energy", [("mean", 200.0), ("drop", 200.0 * 40 / 60)])
+def test_ramp_policy(power_root, ramp_policy, energy):
+    # 500 W in the first and last 10 minutes of the job, 200 W in between
+    seconds = list(range(36000 - 600, 39600 + 600, 10))
+    power = [500.0 if s < 36600 or s > 39000 else 200.0 for s in seconds]
+    power_root.write(DN001, DAY, seconds, power)
+    report = job_reports(jobs(("100", "2024-03-07 10:00:00", "2024-03-07 11:00:00", "dn001")), power_root,
+                         ramp=600.0, ramp_policy=ramp_policy).iloc[0]
+    assert report["Energy (Wh)"] == pytest.approx(energy)
+    assert report["Average power (W)"] == pytest.approx(200.0)
+
+
+def test_error_readings_are_bridged(power_root):
+    # every other reading of a 1 Hz log is an error message
+    power_root.write(DN001, DAY, range(0, 86400), ["100", "Error: Unable to establish IPMI v2 / RMCP+ session"] * 43200)
+    report = job_reports(jobs(("100", "2024-03-07 10:00:00", "2024-03-07 11:00:00", "dn001")), power_root).iloc[0]
+    assert report["Energy (Wh)"] == pytest.approx(100.0)
+    assert report["Samples"] == 1800
+    assert report["Error readings"] == 1800
+    # the energy is complete, but only half of the readings were valid
+    assert report["Bridged (%)"] == pytest.approx(100.0)
+    assert report["Coverage (%)"] == pytest.approx(50.0)
+    assert report["Confidence"] == "low"
+
+
+def test_sparse_samples_in_a_1hz_log_are_low_coverage(power_root):
+    # the log is sampled every second, except for one sample every 290 s during the job
+    seconds = [s for s in range(0, 86400) if not 36000 <= s < 39600 or s % 290 == 0]
+    power_root.write(DN001, DAY, seconds, 100.0)
+    report = job_reports(jobs(("100", "2024-03-07 10:00:00", "2024-03-07 11:00:00", "dn001")), power_root).iloc[0]
+    assert report["Bridged (%)"] == pytest.approx(100.0)
+    assert report["Coverage (%)"] < 1.0
+    assert report["Confidence"] == "low"
+
+
+def test_node_without_samples(power_root, capsys):
+    power_root.write(DN001, DAY, range(0, 86400, 10), 100.0)
+    job = jobs(("100", "2024-03-07 10:00:00", "2024-03-07 11:00:00", "dn[001-002]"))
+    report = job_reports(job, power_root).set_index("Node")
+    assert report.loc["dn002", "Samples"] == 0
+    assert report.loc["dn002", "Coverage (%)"] == 0.0
+    assert report.loc["dn002", "Confidence"] == "none"
+    assert np.isnan(report.loc["dn002", "Energy (Wh)"])
+
+    # the node is left out of the job's energy with a warning, unless gaps are not to be filled at all
+    table = batch_energy(job, power_root)
+    assert table.loc[0, "Energy (Wh)"] == pytest.approx(100.0)
+    assert table.loc[0, "Nodes"] == 2 and table.loc[0, "Nodes with data"] == 1
+    assert table.loc[0, "Coverage (%)"] == pytest.approx(50.0)
+    assert "no power data on dn002 of job 100" in capsys.readouterr().err
+    assert np.isnan(batch_energy(job, power_root, options={"gap_fill": "nan"}).loc[0, "Energy (Wh)"])
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+
+@pytest.fixture(scope="module")
+def pmu():
+    # parse_module_use parses its command line when it is imported
+    argv = sys.argv
+    sys.argv = ["parse_module_use.py", "--log", os.devnull]
+    try:
+        import parse_module_use
+    finally:
+        sys.argv = argv
+    return parse_module_use
+
+
+def jobs(*rows):
+    df = pd.DataFrame(rows, columns=["JobID", "User", "Start", "End", "NodeList", "AllocCPUS"])
+    df["Start"] = pd.to_datetime(df["Start"])
+    df["End"] = pd.to_datetime(df["End"])
+    return df
+
+
+def loads(*rows):
+    return pd.DataFrame(rows, columns=["dates", "nodes", "users", "modules"])
+
+
+def test_overlapping_jobs_of_one_user(pmu):
+    # job 101 starts after job 100 and ends first, the load at 03:00 is still inside job 100
+    sacct = jobs(
+        ("100", "alice", "2024-03-07 00:00:00", "2024-03-07 10:00:00", "dn001", 4),
+        ("101", "alice", "2024-03-07 01:00:00", "2024-03-07 02:00:00", "dn001", 2),
+    )
+    df = loads(
+        ("2024-03-07 03:00:00", "dn001.cluster", "alice", "gcc/12.2.0"),
+        ("2024-03-07 01:30:00", "dn001", "alice", "python/3.11"),
+        ("2024-03-07 11:00:00", "dn001", "alice", "cmake/3.27"),
+    )
+    attributed = pmu.attribute_jobs(df, sacct)
+    assert dict(zip(attributed["modules"], attributed["JobID"])) == {"gcc/12.2.0": "100", "python/3.11": "101"}
+
+    usage = pmu.module_core_hours(attributed).set_index("modules")
+    assert usage.loc["gcc/12.2.0", "Core-hours"] == 40.0
+    assert usage.loc["python/3.11", "Core-hours"] == 2.0
+
+
+def test_loads_match_only_the_same_user_and_node(pmu):
+    sacct = jobs(
+        ("100", "alice", "2024-03-07 00:00:00", "2024-03-07 10:00:00", "dn[001-002]", 8),
+        ("101", "bob", "2024-03-07 01:00:00", "2024-03-07 02:00:00", "dn001", 2),
+    )
+    df = loads(
+        ("2024-03-07 01:30:00", "dn002", "alice", "gcc/12.2.0"),
+        ("2024-03-07 01:30:00", "dn001", "bob", "gcc/12.2.0"),
+        ("2024-03-07 01:30:00", "dn003", "alice", "gcc/12.2.0"),
+        ("2024-03-07 01:30:00", "login1", "bob", "gcc/12.2.0"),
+    )
+    attributed = pmu.attribute_jobs(df, sacct)
+    assert sorted(attributed["JobID"]) == ["100", "101"]
+
+    usage = pmu.module_core_hours(attributed).set_index("modules")
+    assert usage.loc["gcc/12.2.0", "# of jobs"] == 2
+    assert usage.loc["gcc/12.2.0", "Core-hours"] == 82.0
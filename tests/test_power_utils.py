@@ -0,0 +1,116 @@
+import os
+from datetime import date, datetime
+
+import numpy as np
+
+from power_utils import (read_power_day, iter_power_window, read_power_window, cache_file, write_power_cache,
+                         read_power_day_cached, parse_benchmark_log, benchmark_table, node_ip)
+from bench_power_parser import legacy_read
+
+IP = "10.10.9.101"
+
+
+def test_parse_matches_legacy_reader(tmp_path):
+    # readings the old pd.to_numeric based reader accepted or rejected must come out the same
+    readings = ["451", " 451", "451 ", "4.5e2", "1e3", "+451.5", "-3", ".5", "5.", "nan", "",
+                "abc", "12345678901234567", "Error: Unable to establish IPMI v2 / RMCP+ session"]
+    path = tmp_path / "power.csv"
+    path.write_text("".join(f"00:00:{i:02d},{reading}\n" for i, reading in enumerate(readings)))
+    seconds, power = read_power_day(str(path))
+    legacy = legacy_read(str(path))
+    np.testing.assert_array_equal(seconds, np.arange(len(readings)))
+    np.testing.assert_array_equal(power, legacy['power'].to_numpy(dtype=np.float64))
+
+
+def test_iter_power_window_across_midnight(power_root):
+    power_root.write(IP, date(2024, 3, 7), range(86390, 86400), 100.0)
+    power_root.write(IP, date(2024, 3, 8), range(0, 10), 200.0)
+    pieces = list(iter_power_window(power_root, IP, datetime(2024, 3, 7, 23, 59, 55), datetime(2024, 3, 8, 0, 0, 4)))
+    assert [piece[0] for piece in pieces] == [date(2024, 3, 7), date(2024, 3, 8)]
+    # seconds count from the start of the window on both days, samples at the start and end themselves are left out
+    np.testing.assert_array_equal(pieces[0][1], np.arange(1, 5))
+    np.testing.assert_array_equal(pieces[1][1], np.arange(5, 9))
+    seconds, power = read_power_window(power_root, IP, datetime(2024, 3, 7, 23, 59, 55), datetime(2024, 3, 8, 0, 0, 4))
+    np.testing.assert_array_equal(seconds, np.arange(1, 9))
+    np.testing.assert_array_equal(power, [100.0] * 4 + [200.0] * 4)
+
+
+def test_iter_power_window_skips_a_missing_day(power_root, capsys):
+    # three days with the middle one never written, the days around it are still read
+    power_root.write(IP, date(2024, 3, 7), range(0, 86400, 3600), 100.0)
+    power_root.write(IP, date(2024, 3, 9), range(0, 86400, 3600), 300.0)
+    pieces = list(iter_power_window(power_root, IP, datetime(2024, 3, 7, 12), datetime(2024, 3, 9, 12)))
+    assert [piece[0] for piece in pieces] == [date(2024, 3, 7), date(2024, 3, 9)]
+    np.testing.assert_array_equal(pieces[0][1], np.arange(1, 12) * 3600.0)
+    np.testing.assert_array_equal(pieces[1][1], np.arange(36, 48) * 3600.0)
+    np.testing.assert_array_equal(pieces[1][2], 300.0)
+    assert f"no power data for {IP} on 2024-03-08" in capsys.readouterr().err
+
+
+def test_power_cache_round_trip(power_root, tmp_path):
+    path = power_root.write(IP, date(2024, 3, 7), [0, 1, 2, 86399], ["450.5", "Error", "452", "1e3"])
+    cache_dir = str(tmp_path / "cache")
+    cache = write_power_cache(path, cache_dir)
+    assert cache == cache_file(path, cache_dir) and cache.startswith(cache_dir)
+    seconds, power = read_power_day_cached(path, cache_dir)
+    assert isinstance(power, np.memmap)
+    np.testing.assert_array_equal(seconds, [0, 1, 2, 86399])
+    np.testing.assert_array_equal(power, np.array([450.5, np.nan, 452, 1000], dtype=np.float32))
+
+
+def test_stale_power_cache_is_ignored(power_root, tmp_path):
+    path = power_root.write(IP, date(2024, 3, 7), [0, 1], 100.0)
+    cache_dir = str(tmp_path / "cache")
+    cache = write_power_cache(path, cache_dir)
+    # the log was appended to after the cache was written
+    power_root.write(IP, date(2024, 3, 7), [0, 1, 2], 200.0)
+    os.utime(cache, (1000000000, 1000000000))
+    seconds, power = read_power_day_cached(path, cache_dir)
+    np.testing.assert_array_equal(seconds, [0, 1, 2])
+    np.testing.assert_array_equal(power, 200.0)
+
+
+BENCHMARK_LOG = """Node: xm007
+Benchmark 1: ./app -p 1
+Start Time: 03/07/24 10:00:00
+End Time: 03/07/24 12:00:00
+Benchmark 2: ./app -p 2
+Start Time: 03/07/24 12:10:00
+End Time: 03/07/24 13:10:00
+Node: xm008
+Benchmark 3: ./app -T 4
+Start Time: 03/07/24 15:10:00
+End Time: 03/07/24 15:40:00
+Benchmark 4: ./app -T 2
+Start Time: 03/07/24 14:00:00
+End Time: 03/07/24 15:00:00
+Benchmark 5: ./app -T 8
+Start Time: 03/07/24 16:00:00
+"""
+
+
+def test_parse_benchmark_log(tmp_path):
+    path = tmp_path / "bench.log"
+    path.write_text(BENCHMARK_LOG)
+    records = parse_benchmark_log(str(path))
+    # benchmark 5 never finished
+    assert [(r["benchmark"], r["flag"], r["threads"], r["node"]) for r in records] == [
+        (1, "p", 1, "xm007"), (2, "p", 2, "xm007"), (3, "T", 4, "xm008"), (4, "T", 2, "xm008")]
+    assert records[0]["start"] == datetime(2024, 3, 7, 10) and records[0]["end"] == datetime(2024, 3, 7, 12)
+
+
+def test_benchmark_table_scaling_per_flag(power_root, tmp_path):
+    # a constant 100 W on both nodes, so the energy only depends on the duration
+    for ip_addr in ("10.10.9.7", "10.10.9.8"):
+        power_root.write(ip_addr, date(2024, 3, 7), range(0, 86400, 10), 100.0)
+    path = tmp_path / "bench.log"
+    path.write_text(BENCHMARK_LOG)
+    table = benchmark_table(parse_benchmark_log(str(path)), power_root, node_ip, runs=2, scaling=True).set_index("Benchmark")
+    # sorted by flag, then by thread count
+    assert list(table.index) == [4, 3, 1, 2]
+    np.testing.assert_allclose(table.loc[[1, 2, 4, 3], "Energy (Wh)"], [200.0, 100.0, 100.0, 50.0])
+    np.testing.assert_allclose(table.loc[[1, 2, 4, 3], "Energy per run (Wh)"], [100.0, 50.0, 50.0, 25.0])
+    # the baseline is the lowest thread count of each flag: 1 thread for -p, 2 threads for -T
+    np.testing.assert_allclose(table.loc[[1, 2, 4, 3], "Speedup"], [1.0, 2.0, 1.0, 2.0])
+    np.testing.assert_allclose(table.loc[[1, 2, 4, 3], "Relative energy-to-solution"], [1.0, 0.5, 1.0, 0.5])
+    np.testing.assert_allclose(table.loc[[1, 2, 4, 3], "Energy-to-solution (kJ)"], [360.0, 180.0, 180.0, 90.0])
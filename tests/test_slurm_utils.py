@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+from slurm_utils import read_sacct_dump, expand_nodelist
+
+
+def test_expand_nodelist():
+    assert expand_nodelist("dg[035-036,042],dn001") == ["dg035", "dg036", "dg042", "dn001"]
+
+
+def test_read_sacct_dump_without_header(tmp_path):
+    # the documented --format=JobID,User,Start,End,NodeList,AllocCPUS with --noheader
+    path = tmp_path / "jobs.txt"
+    path.write_text("100|alice|2024-03-07T10:00:00|2024-03-07T12:00:00|dn[001-002]|96\n"
+                    "100.batch|alice|2024-03-07T10:00:00|2024-03-07T12:00:00|dn001|48\n"
+                    "101|bob|2024-03-07T11:00:00|Unknown|dn003|4\n")
+    jobs = read_sacct_dump(str(path))
+    assert list(jobs["JobID"]) == ["100", "101"]
+    assert list(jobs["AllocCPUS"]) == [96, 4]
+    assert jobs.loc[0, "Start"] == pd.Timestamp("2024-03-07 10:00:00")
+    assert pd.isna(jobs.loc[1, "End"])
+
+
+def test_read_sacct_dump_header_in_any_order(tmp_path):
+    path = tmp_path / "jobs.txt"
+    path.write_text("JobID|NodeList|AllocCPUS|User|Start|End|State\n"
+                    "100|dn001|8|alice|2024-03-07T10:00:00|2024-03-07T12:00:00|COMPLETED\n")
+    jobs = read_sacct_dump(str(path))
+    assert jobs.loc[0, "NodeList"] == "dn001"
+    assert jobs.loc[0, "AllocCPUS"] == 8
+
+
+@pytest.mark.parametrize("text", ["100|alice|2024-03-07T10:00:00|2024-03-07T12:00:00\n",
+                                  "JobID|User|Start|End\n100|alice|2024-03-07T10:00:00|2024-03-07T12:00:00\n"])
+def test_read_sacct_dump_explains_the_expected_format(tmp_path, text):
+    path = tmp_path / "jobs.txt"
+    path.write_text(text)
+    with pytest.raises(ValueError, match="JobID,User,Start,End,NodeList,AllocCPUS"):
+        read_sacct_dump(str(path))